@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+    Benchmark generate_report.py against mock_intersight.py
+    For each fleet size, starts the mock server, runs generate_report.py in a
+    scratch directory and reports the end-to-end runtime, peak RSS, API counters
+    and per-phase times (from ./Data/run_stats.json)
+
+    Usage: ./benchmark.py --servers 100,1000,10000 --latency 0.05 --throttle 0.01 --set Streaming=true
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+from metrics import COUNTERS, PHASES
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# Settings every benchmark run starts from, a local .env must not change the results
+BASE_ENV = {
+    "ClientId": "benchmark",
+    "ClientSecret": "benchmark",
+    "Cache": "false",
+    "Offline": "false",
+    "Sync": "false",
+    "Profile": "false",
+    "RunStatsSheet": "false",
+    "TokenFile": "",
+    "Targets": "",
+}
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(servers, port, latency, throttle, compress=True):
+    """
+        Start mock_intersight.py in its own process, return it once it accepts connections
+    """
+    command = [sys.executable, os.path.join(REPO_DIR, "mock_intersight.py"), "--servers", str(servers),
+               "--port", str(port), "--latency", str(latency), "--throttle", str(throttle)]
+    if not compress:
+        command.append("--no-gzip")
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    print(f"Mock server did not start on port {port}", file=sys.stderr)
+    sys.exit(1)
+
+
+def run_report(work_dir, env):
+    """
+        Run generate_report.py in work_dir, return (exit code, runtime seconds, peak RSS MB)
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "generate_report.py")],
+                               cwd=work_dir, env=env, stdout=subprocess.DEVNULL)
+    # wait4 returns the resource usage of this child only, not of the mock server
+    _, status, usage = os.wait4(process.pid, 0)
+    runtime = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    peak_rss = usage.ru_maxrss / 1024 if sys.platform != "darwin" else usage.ru_maxrss / 1024 / 1024
+    return process.returncode, runtime, peak_rss
+
+
+def run_benchmark(servers, args):
+    """
+        Benchmark one fleet size, return a result dict per run
+    """
+    port = get_free_port()
+    mock = start_mock(servers, port, args.latency, args.throttle, compress=not args.no_gzip)
+    results = []
+    try:
+        for run in range(args.runs):
+            work_dir = tempfile.mkdtemp(prefix=f"benchmark_{servers}_")
+            shutil.copy(os.path.join(REPO_DIR, "intersight_urls.json"), work_dir)
+            env = dict(os.environ)
+            env.update(BASE_ENV)
+            env.update(args.settings)
+            env["BaseUrl"] = f"http://127.0.0.1:{port}"
+            exit_code, runtime, peak_rss = run_report(work_dir, env)
+
+            result = {"servers": servers, "run": run + 1, "exit_code": exit_code,
+                      "runtime": round(runtime, 3), "peak_rss_mb": round(peak_rss, 1)}
+            stats_file = os.path.join(work_dir, "Data", "run_stats.json")
+            if os.path.exists(stats_file):
+                with open(stats_file, 'r') as f:
+                    total = json.load(f)["endpoints"][-1]
+                result.update({k: total[k] for k in COUNTERS + PHASES})
+            results.append(result)
+            print_result(result)
+
+            if args.keep:
+                print(f"-> Output kept in {work_dir}")
+            else:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        mock.terminate()
+        mock.wait()
+    return results
+
+
+def print_header():
+    columns = ["servers", "run", "runtime", "peak_rss_mb"] + COUNTERS + PHASES
+    print("".join(f"{c:>12}" for c in columns))
+
+
+def print_result(result):
+    if result["exit_code"] != 0:
+        print(f"{result['servers']:>12}{result['run']:>12}  generate_report.py failed (exit code {result['exit_code']})")
+        return
+    columns = ["servers", "run", "runtime", "peak_rss_mb"] + COUNTERS + PHASES
+    print("".join(f"{result.get(c, ''):>12}" for c in columns))
+
+
+def parse_setting(text):
+    key, separator, value = text.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got {text}")
+    return key, value
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark generate_report.py against a mock Intersight API")
+    parser.add_argument("--servers", default="100,1000,10000",
+                        help="comma separated fleet sizes (default: 100,1000,10000)")
+    parser.add_argument("--runs", type=int, default=1, help="runs per fleet size (default: 1)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API response")
+    parser.add_argument("--throttle", type=float, default=0.0, help="fraction of API requests answered with 429")
+    parser.add_argument("--no-gzip", action="store_true", help="mock server never compresses responses")
+    parser.add_argument("--set", dest="settings", type=parse_setting, action="append", default=[],
+                        metavar="KEY=VALUE", help="generate_report.py setting, e.g. --set Streaming=true")
+    parser.add_argument("--output", help="write all results to this JSON file")
+    parser.add_argument("--keep", action="store_true", help="keep each run's ./Data directory")
+    args = parser.parse_args()
+    args.settings = dict(args.settings)
+
+    print_header()
+    all_results = []
+    for servers in [int(s) for s in args.servers.split(",")]:
+        all_results += run_benchmark(servers, args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps({"latency": args.latency, "throttle": args.throttle,
+                                "settings": args.settings, "results": all_results}, indent=4))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+    On-disk cache for Intersight API responses
+    Entries are keyed by the full request URL ($select/$expand/$skip included),
+    expire after a per-endpoint TTL and are evicted least recently used first
+    once the cache grows past its size limit
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+        Persistent response cache, one JSON file per request URL
+        TTLs are registered per URL prefix, e.g. "https://intersight.com/api/v1/compute/Boards"
+        In offline mode every cached entry is served regardless of its age
+        entries maps each cache file to its size, least recently used first,
+        read from the directory once so eviction never rescans it
+    """
+    def __init__(self, cache_dir="./Data/cache", max_size=500 * 1024 * 1024, default_ttl=0, offline=False):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.offline = offline
+        self.ttls = {}
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        files = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        files.sort()
+        self.entries = OrderedDict((path, size) for _, path, size in files)
+        self.size = sum(self.entries.values())
+
+    def set_ttl(self, url_prefix, ttl):
+        """
+            Set the TTL in seconds for every URL starting with url_prefix
+        """
+        self.ttls[url_prefix] = ttl
+
+    def get_ttl(self, api_url):
+        """
+            Return the TTL of the longest registered prefix matching the URL
+        """
+        ttl = self.default_ttl
+        match_len = 0
+        for url_prefix, prefix_ttl in self.ttls.items():
+            if api_url.startswith(url_prefix) and len(url_prefix) > match_len:
+                ttl = prefix_ttl
+                match_len = len(url_prefix)
+        return ttl
+
+    def get_path(self, api_url):
+        """
+            Return the cache file path for a request URL
+        """
+        key = hashlib.sha256(api_url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, api_url):
+        """
+            Return the cached response data, or None if missing or expired
+        """
+        path = self.get_path(api_url)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["url"] != api_url:
+            return None
+        if not self.offline and time.time() - entry["fetched"] > self.get_ttl(api_url):
+            return None
+        # Mark as recently used for LRU eviction, the mtime keeps the order across runs
+        with self.lock:
+            if path in self.entries:
+                self.entries.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["data"]
+
+    def set(self, api_url, data):
+        """
+            Store response data for a request URL, then evict if over the size limit
+        """
+        path = self.get_path(api_url)
+        entry = {"url": api_url, "fetched": time.time(), "data": data}
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(entry))
+        with self.lock:
+            os.replace(tmp_path, path)
+            self.size -= self.entries.pop(path, 0)
+            self.entries[path] = os.path.getsize(path)
+            self.size += self.entries[path]
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """
+            Remove least recently used entries until the cache fits in max_size
+            The entry just stored is the most recent one and goes last
+            Called with self.lock held
+        """
+        while self.size > self.max_size and self.entries:
+            path, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
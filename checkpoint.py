@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+    Checkpoints of a report run, kept in <data_dir>/checkpoint
+    Finished sheets are recorded in manifest.json with their data file, so a
+    run that fails partway can be resumed with --resume without downloading
+    again the sheets it already has. With pages=True every fetched page is
+    also saved under pages/, at the cost of writing each page to disk once more
+"""
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+
+class Checkpoint:
+    """
+        Sheets are keyed by the query they were fetched with and pages by their
+        URL, so an entry changed in intersight_urls.json is fetched again
+        Without resume, the checkpoint of the previous run is discarded
+    """
+    def __init__(self, directory, resume=False, pages=False):
+        self.directory = directory
+        self.pages_dir = os.path.join(directory, "pages")
+        self.manifest_file = os.path.join(directory, "manifest.json")
+        self.lock = threading.Lock()
+        if not resume:
+            shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(self.pages_dir if pages else directory, exist_ok=True)
+        self.sheets = {}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r') as f:
+                self.sheets = json.load(f)["sheets"]
+
+    def get_sheet(self, sheet_name, key):
+        """
+            Return the checkpoint of a sheet finished with the same key, or None
+            data_file is None for a sheet that had no data
+        """
+        entry = self.sheets.get(sheet_name)
+        if entry is None or entry["key"] != key:
+            return None
+        if entry["data_file"] is not None and not os.path.exists(entry["data_file"]):
+            return None
+        return entry
+
+    def save_sheet(self, sheet_name, key, data_file, **details):
+        """
+            Record a finished sheet, details are kept with it, e.g. a streamed sheet's header list
+        """
+        with self.lock:
+            self.sheets[sheet_name] = dict(details, key=key, data_file=data_file)
+            self.write_json(self.manifest_file, {"sheets": self.sheets})
+
+    def get_page_file(self, api_url, kind):
+        key = hashlib.sha1(f"{kind} {api_url}".encode()).hexdigest()
+        return os.path.join(self.pages_dir, f"{key}.json")
+
+    def get_page(self, api_url, kind):
+        """
+            Return a saved page as (results, other top-level members), or None
+            kind tells raw Results and flattened rows of the same URL apart
+        """
+        try:
+            with open(self.get_page_file(api_url, kind), 'r') as f:
+                page = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return page["results"], page["fields"]
+
+    def save_page(self, api_url, kind, results, fields):
+        self.write_json(self.get_page_file(api_url, kind), {"fields": fields, "results": results})
+
+    def write_json(self, file_name, data):
+        """
+            Write through a temporary file, a crash never leaves a partial checkpoint
+        """
+        temp_file = f"{file_name}.{threading.get_ident()}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_file, file_name)
+
+    def finish(self):
+        """
+            Drop the saved pages once every sheet is written
+            The manifest is kept, --resume then rebuilds the workbook from the data files
+        """
+        shutil.rmtree(self.pages_dir, ignore_errors=True)
@@ -1,21 +1,133 @@
 #!/usr/bin/env python3
 """
     Common Functions to use with Intersight API
-    Libraries: pip install requests jsonpath-ng openpyxl flatten-json
+    Libraries: pip install requests jsonpath-ng flatten-json
+    Excel helpers are in workbook.py, so API-only runs never import openpyxl
 """
 import sys
 import os
 import json
 import re
 import time
+import threading
+import queue
+import multiprocessing
 import requests
-from openpyxl import load_workbook
-from openpyxl.workbook import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
+from collections import deque
+from itertools import chain, islice
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from ratelimit import RateGovernor
+from compact import CompactRows
+from jsonstream import loads, iter_results, CHUNK_SIZE
 
-def get_token(client_id, client_secret):
-    """ Get oAuth Token """
-    token_url="https://intersight.com/iam/token"
+# Intersight URL, the token and API requests are made under it
+BASE_URL = "https://intersight.com"
+# Objects requested per page ($top)
+PAGE_SIZE = 1000
+# Default number of pages fetched in parallel by get_all
+PAGE_WORKERS = 8
+# Global cap on API requests in flight across all endpoints and pages
+MAX_IN_FLIGHT = 16
+# Retries of a throttled (429) or temporarily unavailable page before giving up
+MAX_RETRIES = 8
+RETRY_STATUS_CODES = [429, 502, 503, 504]
+# Seconds to connect and between bytes received, a stalled request is retried like a dropped one
+REQUEST_TIMEOUT = (10, 120)
+
+
+def get_session(pool_size=MAX_IN_FLIGHT):
+    """
+        Return a requests Session with a keep-alive connection pool
+        large enough for pool_size concurrent requests
+    """
+    session = requests.Session()
+    # Compressed responses: gzip/deflate, plus br and zstd when brotli or zstandard is installed
+    session.headers.update(make_headers(accept_encoding=True))
+    # Page bodies are streamed after the governor slot is released, so up to
+    # pool_size more connections can still be reading a body
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=2 * pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Shared Session, reused by every API call so pages skip the TCP+TLS handshake
+session = get_session()
+# Shared rate governor, held by every API call while its request is in flight
+rate_governor = RateGovernor(max_in_flight=MAX_IN_FLIGHT)
+
+
+def set_base_url(base_url):
+    """
+        Update the Intersight URL, e.g. an appliance or a local mock server
+    """
+    global BASE_URL
+    BASE_URL = base_url.rstrip("/")
+
+
+def set_page_workers(page_workers):
+    """
+        Update the number of pages fetched in parallel per endpoint
+    """
+    global PAGE_WORKERS
+    PAGE_WORKERS = max(1, int(page_workers))
+
+
+def set_rate_limit(rate, max_rate=None):
+    """
+        Update the starting and maximum request rate (requests per second)
+    """
+    rate_governor.rate = float(rate)
+    if max_rate is not None:
+        rate_governor.max_rate = float(max_rate)
+
+
+def set_max_in_flight(max_in_flight):
+    """
+        Update the global in-flight request cap and resize the shared connection pool
+    """
+    global MAX_IN_FLIGHT, session
+    MAX_IN_FLIGHT = max(1, int(max_in_flight))
+    rate_governor.set_max_in_flight(MAX_IN_FLIGHT)
+    session.close()
+    session = get_session(MAX_IN_FLIGHT)
+
+
+# Optional cache.ResponseCache used by get_api_data
+response_cache = None
+# Optional TokenManager, when set get_api_data ignores the token it is passed
+token_manager = None
+# Optional metrics.RunMetrics, records every API response
+run_metrics = None
+# Optional checkpoint.Checkpoint, every fetched page is saved there for --resume (CheckpointPages=true)
+page_checkpoint = None
+
+
+def set_response_cache(cache):
+    """
+        Route every API call through the provided ResponseCache (None disables caching)
+    """
+    global response_cache
+    response_cache = cache
+
+
+def set_page_checkpoint(checkpoint):
+    """
+        Save every fetched page to the provided Checkpoint and reuse the saved
+        pages instead of fetching them again (None disables checkpointing)
+    """
+    global page_checkpoint
+    page_checkpoint = checkpoint
+
+
+def request_token(client_id, client_secret):
+    """
+        Request an oAuth Token, return the token response (access_token, expires_in)
+    """
+    token_url=f"{BASE_URL}/iam/token"
     client_auth = requests.auth.HTTPBasicAuth(client_id, client_secret)
     post_data = {"grant_type": "client_credentials"}
     response = requests.post(url=token_url,
@@ -25,28 +137,216 @@ def get_token(client_id, client_secret):
         print("Failed to obtain token from the OAuth 2.0 server", file=sys.stderr)
         sys.exit(1)
     print("Successfuly obtained a new token")
-    json_data = response.json()
+    return response.json()
+
+
+def set_run_metrics(metrics):
+    """
+        Record every API response in the provided RunMetrics
+    """
+    global run_metrics
+    run_metrics = metrics
+
+
+def set_token_manager(manager):
+    """
+        Make every API call take its token from the provided TokenManager
+    """
+    global token_manager
+    token_manager = manager
+
+
+def get_token(client_id, client_secret):
+    """ Get oAuth Token """
+    json_data = request_token(client_id, client_secret)
     token = json_data["access_token"]
     return token
 
 
-def get_api_data(client_id, client_secret, token, api_url):
-    """ Get API Endpoint Data """
+class TokenManager:
+    """
+        Thread-safe oAuth token shared by all API workers
+        Tracks expires_in and refreshes the token refresh_margin seconds before
+        expiry. While one caller refreshes, the others keep using the current token
+        With token_file, the token is persisted (mode 0600) and reused by later runs
+    """
+    def __init__(self, client_id, client_secret, token_file=None, refresh_margin=300):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_file = token_file
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self.expires_at = 0
+        self.refresh_lock = threading.Lock()
+        if token_file:
+            self.load()
+
+    def load(self):
+        """
+            Reuse a persisted token of the same client if it has not expired
+        """
+        try:
+            with open(self.token_file, 'r') as f:
+                json_data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if json_data.get("client_id") == self.client_id and json_data.get("expires_at", 0) > time.time():
+            self.token = json_data["access_token"]
+            self.expires_at = json_data["expires_at"]
+            print("Reusing saved token")
+
+    def save(self):
+        """
+            Persist the token, readable by the owner only
+        """
+        json_data = {"client_id": self.client_id, "access_token": self.token, "expires_at": self.expires_at}
+        fd = os.open(self.token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.chmod(self.token_file, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(json_data))
+
+    def fetch(self):
+        """
+            Request a new token, called with refresh_lock held
+        """
+        json_data = request_token(self.client_id, self.client_secret)
+        self.expires_at = time.time() + int(json_data.get("expires_in", 3600))
+        self.token = json_data["access_token"]
+        if self.token_file:
+            self.save()
+
+    def get_token(self):
+        """
+            Return a valid token, refreshing it when close to expiry
+        """
+        now = time.time()
+        if self.token and now < self.expires_at - self.refresh_margin:
+            return self.token
+        if self.token and now < self.expires_at:
+            # Close to expiry: one caller refreshes, the others keep the current token
+            if self.refresh_lock.acquire(blocking=False):
+                try:
+                    self.fetch()
+                finally:
+                    self.refresh_lock.release()
+            return self.token
+        with self.refresh_lock:
+            if not self.token or time.time() >= self.expires_at - self.refresh_margin:
+                self.fetch()
+            return self.token
+
+    def invalidate(self, stale_token):
+        """
+            Replace a token rejected with 401, unless another caller already did
+        """
+        with self.refresh_lock:
+            if self.token == stale_token:
+                self.fetch()
+            return self.token
+
+
+def send_request(client_id, client_secret, token, api_url, refresh_on_401=True, stream=False):
+    """
+        GET an API URL, retrying RETRY_STATUS_CODES and refreshing an expired token once
+        Connection errors and timeouts are retried the same way, the last one is raised
+        Returns the last response, its body is not decoded
+        With stream=True the body of a 200 response is left on the connection
+        for the caller to read, and to record with run_metrics.record_bytes
+    """
+    if token_manager is not None:
+        token = token_manager.get_token()
     headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url=api_url, headers=headers)
-    data = response.json()
-    if	response.status_code == 401:
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with rate_governor.request():
+                response = session.get(url=api_url, headers=headers, stream=stream, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.SSLError:
+            # A certificate problem does not go away by retrying
+            raise
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            if run_metrics is not None:
+                run_metrics.record_response(api_url, None, 0, True)
+            wait = rate_governor.throttled(None, attempt)
+            print(f"-> {type(e).__name__} from {api_url}. retrying after {wait:.1f}s")
+            continue
+        if stream and response.status_code != requests.codes.ok:
+            # Error bodies are read right away, the connection goes back to the pool
+            response.content
+        retry = response.status_code in RETRY_STATUS_CODES and attempt < MAX_RETRIES
+        if run_metrics is not None:
+            retried = retry or (response.status_code == 401 and refresh_on_401)
+            # Bytes on the wire, before gzip/deflate decoding
+            run_metrics.record_response(api_url, response.status_code, response.raw.tell(), retried)
+        if not retry:
+            break
+        # Governor slows down and pauses every caller, then the same page is retried
+        wait = rate_governor.throttled(response.headers.get("Retry-After"), attempt)
+        print(f"-> got {response.status_code} from {api_url}. retrying after {wait:.1f}s")
+    if	response.status_code == 401 and refresh_on_401:
         print("-> Existing Token Expired. Generating a new one!")
-        token = get_token(client_id, client_secret)
-        get_api_data(client_id, client_secret, token, api_url)
-    if response.status_code == 429:
-        wait = response.headers.get("Retry-After", 600)
-        print(f"-> got {response.status_code} from {api_url}. retrying after {wait}s")
-        time.sleep(int(wait))
-    elif response.status_code == requests.codes.ok:
-        return data
-    else:
-        print(f"-> got {response.status_code} from {api_url}")
+        if token_manager is not None:
+            token = token_manager.invalidate(token)
+        else:
+            token = get_token(client_id, client_secret)
+        return send_request(client_id, client_secret, token, api_url, refresh_on_401=False, stream=stream)
+    if response.status_code == requests.codes.ok:
+        rate_governor.update(response.headers)
+    return response
+
+
+def check_response(response, api_url):
+    """
+        Raise requests.HTTPError for a response other than 200, once its retries
+        are used up, so a failed page stops the run naming its URL and status
+    """
+    if response.status_code != requests.codes.ok:
+        print(f"-> got {response.status_code} from {api_url}", file=sys.stderr)
+        raise requests.HTTPError(f"{response.status_code} {response.reason} for url: {api_url}", response=response)
+
+
+def get_api_data(client_id, client_secret, token, api_url, refresh_on_401=True):
+    """
+        Get API Endpoint Data
+        Raises requests.HTTPError when the request fails, see check_response
+    """
+    if response_cache is not None:
+        data = response_cache.get(api_url)
+        if data is not None:
+            return data
+        if response_cache.offline:
+            print(f"-> {api_url} not in cache, skipping", file=sys.stderr)
+            return {"Count": 0, "Results": []}
+    response = send_request(client_id, client_secret, token, api_url, refresh_on_401)
+    check_response(response, api_url)
+    data = loads(response.content)
+    if response_cache is not None:
+        response_cache.set(api_url, data)
+    return data
+
+
+def iter_api_results(client_id, client_secret, token, api_url, fields=None):
+    """
+        Yield the Results objects of one page, decoded incrementally from the
+        response body, see jsonstream.iter_results
+        The other top-level members (Count, ObjectType) are stored in fields
+        With the response cache the page is decoded whole, as it is cached whole
+    """
+    if response_cache is not None:
+        response = get_api_data(client_id, client_secret, token, api_url)
+        if fields is not None:
+            fields.update((k, v) for k, v in response.items() if k != "Results")
+        yield from response["Results"]
+        return
+    response = send_request(client_id, client_secret, token, api_url, stream=True)
+    check_response(response, api_url)
+    try:
+        yield from iter_results(response.iter_content(CHUNK_SIZE), fields)
+    finally:
+        response.close()
+    if run_metrics is not None:
+        run_metrics.record_bytes(api_url, response.raw.tell())
 
 
 def get_count(client_id, client_secret, token, api_url):
@@ -58,118 +358,339 @@ def get_count(client_id, client_secret, token, api_url):
     return total_count
 
 
-def get_all(client_id, client_secret, token, api_url, total_count):
+def get_page_url(api_url, skip, top=PAGE_SIZE):
     """
-        Pagination code to get all the objects
+        Append $top/$skip pagination parameters to an API URL
+    """
+    if "?" in api_url:
+        return f"{api_url}&$top={top}&$skip={skip}"
+    return f"{api_url}?$top={top}&$skip={skip}"
+
+
+def add_filter(api_url, condition):
+    """
+        Add a condition to the $filter of an API URL, and-ed with any existing filter
+    """
+    path, _, query = api_url.partition("?")
+    params = query.split("&") if query else []
+    for i, param in enumerate(params):
+        if param.startswith("$filter="):
+            params[i] = f"$filter=({param[len('$filter='):]}) and ({condition})"
+            break
+    else:
+        params.append(f"$filter={condition}")
+    return f"{path}?{'&'.join(params)}"
+
+
+def get_moid_url(api_url):
+    """
+        Return a Moid-only listing URL for an API URL, keeping its $filter
+    """
+    path, _, query = api_url.partition("?")
+    params = [param for param in query.split("&") if param.startswith("$filter=")]
+    params.append("$select=Moid")
+    return f"{path}?{'&'.join(params)}"
+
+
+def load_page(api_path, kind, fields):
+    """
+        Return the Results of a page saved by the page checkpoint, or None
+    """
+    if page_checkpoint is None:
+        return None
+    page = page_checkpoint.get_page(api_path, kind)
+    if page is None:
+        return None
+    results, page_fields = page
+    if fields is not None:
+        fields.update(page_fields)
+    return results
+
+
+def get_page_results(client_id, client_secret, token, api_path, fields=None):
+    """
+        Return the Results of a single page
+        The other top-level members (Count, ObjectType) are stored in fields
+    """
+    results = load_page(api_path, "results", fields)
+    if results is not None:
+        return results
+    response = get_api_data(client_id, client_secret, token, api_path)
+    page_fields = {k: v for k, v in response.items() if k != "Results"}
+    if fields is not None:
+        fields.update(page_fields)
+    if page_checkpoint is not None:
+        page_checkpoint.save_page(api_path, "results", response["Results"], page_fields)
+    return response["Results"]
+
+
+def get_page_rows(client_id, client_secret, token, api_path, fields=None, plans=None):
+    """
+        Return the flattened rows of a single page
+        Objects are flattened as they are decoded, the page is never held as
+        one object tree
+        plans is a list shared by the pages of an endpoint: the first page
+        compiles the flatten plan from its first PLAN_SAMPLE_SIZE objects and
+        appends it, the following pages reuse it. Pages decoded at the same
+        time, e.g. the first pages of cursor ranges, keep the first plan
+        appended. Without plans, each page compiles its own
     """
-    increment = 1000
-    skip = 0
+    rows = load_page(api_path, "rows", fields)
+    if rows is not None:
+        return rows
+    page_fields = {}
+    objects = iter_api_results(client_id, client_secret, token, api_path, page_fields)
+    if plans:
+        plan = plans[0]
+    else:
+        sample = list(islice(objects, PLAN_SAMPLE_SIZE))
+        objects = chain(sample, objects)
+        with plan_lock:
+            if plans:
+                plan = plans[0]
+            else:
+                plan = compile_flatten_plan(sample)
+                if plans is not None and sample:
+                    plans.append(plan)
+    rows = [apply_flatten_plan(item, plan, {}) for item in objects]
+    if fields is not None:
+        fields.update(page_fields)
+    if page_checkpoint is not None:
+        page_checkpoint.save_page(api_path, "rows", rows, page_fields)
+    return rows
+
+
+def get_pages(client_id, client_secret, token, api_url, skips, max_workers=None):
+    """
+        Fetch the pages at the given $skip offsets in parallel over the
+        shared Session and return their results in $skip order
+    """
+    if max_workers is None:
+        max_workers = PAGE_WORKERS
+    page_urls = [get_page_url(api_url, skip) for skip in skips]
+
+    def get_page(api_path):
+        return get_page_results(client_id, client_secret, token, api_path)
+
     data = []
-    while (skip <= total_count):
-        if "?" in api_url:
-            api_path = f"{api_url}&$top=1000&$skip={skip}"
-        else:
-            api_path = f"{api_url}?$top=1000&$skip={skip}"
-        response = get_api_data(client_id, client_secret, token, api_path)
-        data.extend(response["Results"])
-        skip += increment
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for results in executor.map(get_page, page_urls):
+            data.extend(results)
     return data
 
 
-def get_data(client_id, client_secret, token, api_count_url, api_url):
+def get_all(client_id, client_secret, token, api_url, total_count, max_workers=None):
     """
-        Get Object Total Count and finally all the data
+        Pagination code to get all the objects
+        Pages are fetched in parallel over the shared Session and
+        reassembled in $skip order
     """
-    # Get Endpoint Data Count
-    total_count = get_count(client_id, client_secret, token, api_count_url)
-    # Get All Data
-    data = get_all(client_id, client_secret, token, api_url, total_count)
+    skips = range(0, total_count, PAGE_SIZE)
+    return get_pages(client_id, client_secret, token, api_url, skips, max_workers)
+
+
+def get_all_inline(client_id, client_secret, token, api_url, max_workers=None):
+    """
+        Pagination code to get all the objects without a separate $count request
+        The first page is requested with $inlinecount=allpages, and its Count
+        is used to schedule the remaining pages
+    """
+    first_page_url = f"{get_page_url(api_url, 0)}&$inlinecount=allpages"
+    fields = {}
+    data = get_page_results(client_id, client_secret, token, first_page_url, fields)
+    total_count = fields["Count"]
+    skips = range(PAGE_SIZE, total_count, PAGE_SIZE)
+    data.extend(get_pages(client_id, client_secret, token, api_url, skips, max_workers))
     return data
 
 
-def get_excel(file_name, sheet_name):
+def iter_pages(client_id, client_secret, token, api_url, max_workers=None, rows=False):
     """
-        Verify if inventory file exists. If not, create one.
-        Add Sheet Name based on provided sheet_name
-        Return active sheet
+        Yield the Results of each page in $skip order
+        The count comes from the first page ($inlinecount). At most max_workers
+        further pages are in flight or waiting to be consumed at any time
+        With rows=True, pages are flattened by the page workers with the plan
+        compiled from the first page, see get_page_rows
     """
-    if os.path.exists(file_name) and os.path.isfile(file_name):
-        workbook = load_workbook(filename=file_name)
-        sheet = workbook.active
-        if len(workbook.sheetnames) == 1 and sheet.title == "Sheet":
-            sheet.title = sheet_name
-            workbook.save(file_name)
-        elif sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-        else:
-            sheet = workbook.create_sheet(sheet_name)
-            workbook.save(file_name)
+    if max_workers is None:
+        max_workers = PAGE_WORKERS
+    get_page = partial(get_page_rows, plans=[]) if rows else get_page_results
+    first_page_url = f"{get_page_url(api_url, 0)}&$inlinecount=allpages"
+    fields = {}
+    results = get_page(client_id, client_secret, token, first_page_url, fields)
+    total_count = fields["Count"]
+    yield results
+    # The first page is not kept alive while the others are fetched
+    results = None
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for skip in range(PAGE_SIZE, total_count, PAGE_SIZE):
+            api_path = get_page_url(api_url, skip)
+            pending.append(executor.submit(get_page, client_id, client_secret, token, api_path))
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def get_cursor_url(api_url, after=None, upto=None, top=PAGE_SIZE):
+    """
+        Return a keyset page URL: objects ordered by Moid, after and up to the given Moids
+    """
+    if after is not None:
+        api_url = add_filter(api_url, f"Moid gt '{after}'")
+    if upto is not None:
+        api_url = add_filter(api_url, f"Moid le '{upto}'")
+    separator = "&" if "?" in api_url else "?"
+    return f"{api_url}{separator}$orderby=Moid&$top={top}"
+
+
+def iter_cursor_range(client_id, client_secret, token, api_url, after=None, upto=None, rows=False, plans=None):
+    """
+        Yield the Results of each page of a Moid range, one page after the other
+        Each page starts after the last Moid of the previous one, so deep pages
+        cost the same as the first and objects added or removed mid-crawl never
+        shift the following pages
+        With rows=True, pages are flattened as they are decoded, see get_page_rows
+        plans is shared with the other ranges of the endpoint
+    """
+    if rows:
+        get_page = partial(get_page_rows, plans=plans if plans is not None else [])
     else:
-        workbook = Workbook()
-        workbook.save(file_name)
-        sheet = workbook.active
-        sheet.title = sheet_name
-        workbook.save(file_name)
-    return workbook, sheet
-       
+        get_page = get_page_results
+    while True:
+        results = get_page(client_id, client_secret, token, get_cursor_url(api_url, after, upto))
+        if results:
+            yield results
+        if len(results) < PAGE_SIZE:
+            return
+        after = results[-1]["Moid"]
 
-def add_header_row(sheet, header_list):
+
+def split_moid_range(client_id, client_secret, token, api_url, ranges):
+    """
+        Split the Moids of a collection into contiguous (after, upto) ranges
+        Boundaries are spread evenly between the lowest and the highest Moid.
+        The first and last ranges are open ended
     """
-        Add Headers Row to the Sheet
+    moid_url = get_moid_url(api_url)
+    first = get_page_results(client_id, client_secret, token, f"{moid_url}&$orderby=Moid&$top=1")
+    last = get_page_results(client_id, client_secret, token, f"{moid_url}&$orderby=Moid desc&$top=1")
+    if not first or not last:
+        return [(None, None)]
+    width = len(first[0]["Moid"])
+    low, high = int(first[0]["Moid"], 16), int(last[0]["Moid"], 16)
+    bounds = sorted(set(f"{low + (high - low) * i // ranges:0{width}x}" for i in range(1, ranges)))
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def iter_cursor_pages(client_id, client_secret, token, api_url, ranges=1, max_workers=None, rows=False):
     """
-    for column, value in enumerate(header_list, start=1):
-        sheet.cell(row=1, column=column, value=value)
-        cell = sheet.cell(row=1, column=column)
-        custom_font = Font(name='Calibri', size=18)  
-        blue_fill = PatternFill(start_color='66ccff', end_color='66ccff', fill_type='solid')
-        cell.font = custom_font
-        cell.fill = blue_fill
+        Yield the Results of each page in Moid order using keyset pagination
+        With ranges > 1, the Moid key space is split and the ranges are fetched
+        in parallel. Each range prefetches on its own, its pages wait in an
+        unbounded buffer until the ranges before it are consumed, so pages
+        still come out in Moid order
+        With rows=True, pages are flattened as they are decoded, see get_page_rows
+    """
+    if max_workers is None:
+        max_workers = PAGE_WORKERS
+    bounds = split_moid_range(client_id, client_secret, token, api_url, ranges) if ranges > 1 else [(None, None)]
+    if len(bounds) == 1:
+        yield from iter_cursor_range(client_id, client_secret, token, api_url, *bounds[0], rows=rows)
+        return
+
+    stop = threading.Event()
+    # The ranges share the flatten plan compiled by the first page to arrive
+    plans = []
+    # A bounded buffer would stall the later ranges until the consumer reaches them
+    queues = [queue.Queue() for _ in bounds]
+
+    def fetch_range(bound, pages):
+        try:
+            for results in iter_cursor_range(client_id, client_secret, token, api_url, *bound, rows=rows,
+                                             plans=plans):
+                if stop.is_set():
+                    return
+                pages.put(results)
+        except Exception as e:
+            pages.put(e)
+            return
+        pages.put(None)
 
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(bounds))) as executor:
+        try:
+            for bound, pages in zip(bounds, queues):
+                executor.submit(fetch_range, bound, pages)
+            for pages in queues:
+                while True:
+                    results = pages.get()
+                    if results is None:
+                        break
+                    if isinstance(results, Exception):
+                        raise results
+                    yield results
+        finally:
+            stop.set()
 
-# def add_cell_data(sheet, data):
-#     """
-#         Add Data in Sheet Cells
-#     """
-#     for row, item in enumerate(data, start=2):
-#         for column in range(1, len(list(item.keys()))+1):
-#             sheet.cell(row=row,column=column, value=list(item.values())[column-1])
-#             cell = sheet.cell(row=row, column=column)
-#             custom_font = Font(name='Calibri', size=14)  
-#             cell.font = custom_font
-#             # cell.alignment=Alignment(vertical='center')
 
-def add_cell_data(sheet, header_list, data):
+def get_cursor_data(client_id, client_secret, token, api_url, ranges=1, max_workers=None):
     """
-        Add Data in Sheet Cells
+        Get all the objects using keyset pagination, in Moid order
     """
-    for row, item in enumerate(data, start=2):
-        for column_name in item.keys():
-            index = header_list.index(column_name)
-            sheet.cell(row=row,column=index+1, value=item[column_name])
-            cell = sheet.cell(row=row, column=index+1)
-            custom_font = Font(name='Calibri', size=14)  
-            cell.font = custom_font
+    data = []
+    for results in iter_cursor_pages(client_id, client_secret, token, api_url, ranges, max_workers):
+        data.extend(results)
+    return data
 
 
+def iter_rows(client_id, client_secret, token, api_url, cursor_ranges=0):
+    """
+        Yield the flattened rows of every object of an API URL, in page order
+        Page workers decode and flatten each page as it arrives, no page or
+        dataset is held as raw objects. With a process pool, the raw pages are
+        flattened on the pool instead, see iter_parsed
+        cursor_ranges > 0 selects keyset pagination, see iter_cursor_pages
+    """
+    rows = cpu_pool is None
+    if cursor_ranges:
+        pages = iter_cursor_pages(client_id, client_secret, token, api_url, cursor_ranges, rows=rows)
+    else:
+        pages = iter_pages(client_id, client_secret, token, api_url, rows=rows)
+    if not rows:
+        yield from iter_parsed(pages)
+        return
+    for page in pages:
+        yield from page
+
 
-def write_to_excel(file_name, sheet_name, header_list, data):
+def get_data(client_id, client_secret, token, api_count_url, api_url, max_workers=None):
     """
-        Add Data to an Excel file under the provided sheet name
+        Get Object Total Count and finally all the data
+        Pass api_count_url=None to take the count from the first data page
     """
-    # Get or Create Workbook and Sheet Name
-    workbook, sheet = get_excel(file_name, sheet_name)
+    if api_count_url is None:
+        return get_all_inline(client_id, client_secret, token, api_url, max_workers)
+    # Get Endpoint Data Count
+    total_count = get_count(client_id, client_secret, token, api_count_url)
+    # Get All Data
+    data = get_all(client_id, client_secret, token, api_url, total_count, max_workers)
+    return data
 
-    # Write Sheet Headers
-    # column_len = len(header_list)
-    add_header_row(sheet, header_list)
 
-    # Write Sheet Cells
-    # add_cell_data(sheet, column_len, data)
-    add_cell_data(sheet, header_list, data)
-    
-    # Save and Close Workbook
-    workbook.save(file_name)
-    workbook.close()
+def get_header_list(data):
+    """
+        Return the union of keys of all the rows, in first-seen order
+    """
+    if isinstance(data, CompactRows):
+        return list(data.columns)
+    header_index = {}
+    for item in data:
+        for column_name in item:
+            if column_name not in header_index:
+                header_index[column_name] = None
+    return list(header_index)
 
 
 def flatten_json(y):
@@ -205,38 +726,257 @@ def parse_data(data):
     return parsed_data
 
 
+# Default parameters removed from the flattened output
+REMOVED_PARAMETERS = ["ObjectType", "ClassId", "Parent_ObjectType", "Parent_ClassId", "Board_ObjectType", "Board_ClassId", "NetworkElement_ClassId", "NetworkElement_ObjectType", "RegisteredDevice_Moid", "RegisteredDevice_ClassId", "RegisteredDevice_ObjectType", "Contract_ClassId", "Contract_ObjectType", "Contract_BillTo_ClassId", "Contract_BillTo_ObjectType", "Contract_BillTo_Address1", "Contract_BillTo_Address2", "Contract_BillTo_Address3", "Contract_BillTo_City", "Contract_BillTo_Country", "Contract_BillTo_County", "Contract_BillTo_Location", "Contract_BillTo_Name", "Contract_BillTo_PostalCode", "Contract_BillTo_Province", "Contract_BillTo_State", "Contract_BillToGlobalUltimate_ClassId", "Contract_BillToGlobalUltimate_ObjectType", "Contract_BillToGlobalUltimate_Id", "Contract_BillToGlobalUltimate_Name", "Source_ClassId", "Source_ObjectType", "Source_Moid", "Source_Name", "Source_PlatformType"]
+REMOVED_PARAMETER_SET = frozenset(REMOVED_PARAMETERS)
+
+
+def remove_item_parameters(item):
+    """
+        Remove Default parameters from a single flattened object
+    """
+    for p in REMOVED_PARAMETER_SET.intersection(item):
+        item.pop(p)
+    return item
+
+
 def remove_parameters(parsed_data):
     """
         Remove Default parameters from output
     """
     data = parsed_data
-    parameters = ["ObjectType", "ClassId", "Parent_ObjectType", "Parent_ClassId", "Board_ObjectType", "Board_ClassId", "NetworkElement_ClassId", "NetworkElement_ObjectType", "RegisteredDevice_Moid", "RegisteredDevice_ClassId", "RegisteredDevice_ObjectType", "Contract_ClassId", "Contract_ObjectType", "Contract_BillTo_ClassId", "Contract_BillTo_ObjectType", "Contract_BillTo_Address1", "Contract_BillTo_Address2", "Contract_BillTo_Address3", "Contract_BillTo_City", "Contract_BillTo_Country", "Contract_BillTo_County", "Contract_BillTo_Location", "Contract_BillTo_Name", "Contract_BillTo_PostalCode", "Contract_BillTo_Province", "Contract_BillTo_State", "Contract_BillToGlobalUltimate_ClassId", "Contract_BillToGlobalUltimate_ObjectType", "Contract_BillToGlobalUltimate_Id", "Contract_BillToGlobalUltimate_Name", "Source_ClassId", "Source_ObjectType", "Source_Moid", "Source_Name", "Source_PlatformType"]
     for item in data:
-        for p in parameters:
-            if p in item:
-                item.pop(p)
+        remove_item_parameters(item)
     return data
 
 
-def auto_size_columns(file_name, sheet_name):
+# Number of leading objects merged into a compiled flatten plan
+PLAN_SAMPLE_SIZE = 10
+# Held while the first page of an endpoint compiles its flatten plan, see get_page_rows
+plan_lock = threading.Lock()
+# Datasets with fewer rows are flattened and transformed in-process
+CPU_POOL_THRESHOLD = 5000
+# Rows per process pool task, large enough to amortize pickling
+CPU_BATCH_SIZE = 2000
+# Optional process pool for flattening and per-row transforms, see set_cpu_workers
+CPU_WORKERS = 0
+cpu_pool = None
+
+
+def set_cpu_workers(cpu_workers):
+    """
+        Flatten and transform datasets of CPU_POOL_THRESHOLD rows or more in a
+        pool of cpu_workers processes (0 or 1 keeps everything in-process)
+        Workers are spawned, not forked, since the API threads may already be running
+    """
+    global CPU_WORKERS, cpu_pool
+    if cpu_pool is not None:
+        cpu_pool.shutdown()
+        cpu_pool = None
+    CPU_WORKERS = max(0, int(cpu_workers))
+    if CPU_WORKERS > 1:
+        cpu_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def map_rows(func, rows):
+    """
+        Apply func, a function from a list of rows to a list of rows that handles
+        each row independently. Small datasets run in-process, larger ones in
+        CPU_BATCH_SIZE batches on the process pool, results kept in order
     """
-        Iterate over all columns and adjust their widths
+    if cpu_pool is None or len(rows) < CPU_POOL_THRESHOLD:
+        return func(rows)
+    batches = [rows[i:i + CPU_BATCH_SIZE] for i in range(0, len(rows), CPU_BATCH_SIZE)]
+    results = []
+    for result in cpu_pool.map(func, batches):
+        results.extend(result)
+    return results
+
+
+def flatten_into(x, name, out):
     """
-    workbook, sheet = get_excel(file_name, sheet_name)
-    for column in sheet.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(cell.value)
-            except:
-                pass
-        adjusted_width = (max_length + 10)
-        sheet.column_dimensions[column_letter].width = adjusted_width
-    # Save and Close Workbook
-    workbook.save(file_name)
-    workbook.close()
+        Recursive flatten of one value into out, skipping REMOVED_PARAMETERS
+        Fallback for shapes a compiled flatten plan does not cover
+    """
+    if type(x) is dict:
+        for a in x:
+            flatten_into(x[a], name + a + '_', out)
+    elif type(x) is list:
+        i = 0
+        for a in x:
+            flatten_into(a, name + str(i) + '_', out)
+            i += 1
+    elif name[:-1] not in REMOVED_PARAMETER_SET:
+        out[name[:-1]] = x
+
+
+def compile_flatten_plan(items, name=''):
+    """
+        Compile the flatten plan for the shape of the sample objects
+        A plan is (prefix, {key: (flat key, sub-plan)}):
+            - flat key is None for REMOVED_PARAMETERS, so they are never built
+            - sub-plan is a nested plan for dicts, None for leaf values and lists
+        Keys and flat keys are computed once here instead of once per object
+    """
+    entries = {}
+    for item in items:
+        for a, value in item.items():
+            if a in entries and entries[a][1] is not None:
+                continue
+            flat_key = name + a
+            if type(value) is dict:
+                sub_items = [sample[a] for sample in items if type(sample.get(a)) is dict]
+                entries[a] = (flat_key, compile_flatten_plan(sub_items, flat_key + '_'))
+            elif flat_key in REMOVED_PARAMETER_SET:
+                entries[a] = (None, None)
+            else:
+                entries[a] = (flat_key, None)
+    return (name, entries)
+
+
+def apply_flatten_plan(x, plan, out):
+    """
+        Flatten one object into out following a compiled plan
+        Keys or values the plan did not see fall back to flatten_into
+    """
+    prefix, entries = plan
+    for a, value in x.items():
+        entry = entries.get(a)
+        if entry is not None:
+            flat_key, sub_plan = entry
+            value_type = type(value)
+            if sub_plan is None and value_type is not dict and value_type is not list:
+                if flat_key is not None:
+                    out[flat_key] = value
+                continue
+            if sub_plan is not None and value_type is dict:
+                apply_flatten_plan(value, sub_plan, out)
+                continue
+        # Irregular shape: recursive fallback for this value
+        flatten_into(value, prefix + a + '_', out)
+    return out
+
+
+def flatten_batch(items, plan):
+    """
+        Flatten a batch of objects with a compiled plan, runs in pool workers too
+    """
+    return [apply_flatten_plan(item, plan, {}) for item in items]
+
+
+def flatten_rows(data, plan=None, compact=False):
+    """
+        Flatten objects and drop Default parameters in a single pass
+        Same output as parse_data followed by remove_parameters. The plan is
+        compiled from the first PLAN_SAMPLE_SIZE objects unless one is provided
+        Large datasets are flattened on the process pool, see map_rows
+        With compact=True the rows are returned as CompactRows
+    """
+    if not data:
+        return []
+    if plan is None:
+        plan = compile_flatten_plan(data[:PLAN_SAMPLE_SIZE])
+    if compact and (cpu_pool is None or len(data) < CPU_POOL_THRESHOLD):
+        # Each row dict is dropped as soon as it is stored
+        return CompactRows(apply_flatten_plan(item, plan, {}) for item in data)
+    parsed_data = map_rows(partial(flatten_batch, plan=plan), data)
+    return CompactRows(parsed_data) if compact else parsed_data
+
+
+def iter_parsed(pages):
+    """
+        Flatten and remove Default parameters one object at a time
+        The flatten plan is compiled from the first page and reused for the rest
+        With a process pool, pages past the first CPU_POOL_THRESHOLD rows are
+        flattened in CPU_BATCH_SIZE batches, a few batches per worker ahead
+    """
+    plan = None
+    seen = 0
+    batch = []
+    pending = deque()
+    for page in pages:
+        if plan is None and page:
+            plan = compile_flatten_plan(page[:PLAN_SAMPLE_SIZE])
+        if cpu_pool is None or seen < CPU_POOL_THRESHOLD:
+            seen += len(page)
+            for item in page:
+                yield apply_flatten_plan(item, plan, {})
+            continue
+        batch.extend(page)
+        if len(batch) >= CPU_BATCH_SIZE:
+            pending.append(cpu_pool.submit(flatten_batch, batch, plan))
+            batch = []
+        while len(pending) > CPU_WORKERS * 2:
+            yield from pending.popleft().result()
+    if batch:
+        pending.append(cpu_pool.submit(flatten_batch, batch, plan))
+    while pending:
+        yield from pending.popleft().result()
+
+
+def dump_rows(rows, f):
+    """
+        Write rows to an open file as a JSON array, one row at a time
+        Same text as f.write(json.dumps(list(rows))), for lists and CompactRows
+    """
+    f.write("[")
+    for i, item in enumerate(rows):
+        if i:
+            f.write(", ")
+        f.write(json.dumps(item if type(item) is dict else dict(item.items())))
+    f.write("]")
+
+
+def spool_rows(rows, data_file):
+    """
+        Append rows to a JSON-lines file as they arrive
+        Returns header list, max value length per column and row count,
+        which a write-only sheet needs before its first row
+    """
+    header_index = {}
+    widths = []
+    count = 0
+    with open(data_file, 'w') as f:
+        for item in rows:
+            f.write(json.dumps(item))
+            f.write("\n")
+            count += 1
+            track_columns(item, header_index, widths)
+    return list(header_index), widths, count
+
+
+def track_columns(item, header_index, widths):
+    """
+        Add the new columns of a row to header_index and widen widths to its values
+    """
+    for column_name, value in item.items():
+        if column_name not in header_index:
+            header_index[column_name] = len(widths)
+            widths.append(len(column_name))
+        index = header_index[column_name]
+        if value is not None and len(str(value)) > widths[index]:
+            widths[index] = len(str(value))
+
+
+def iter_spooled(data_file):
+    """
+        Yield rows back from a JSON-lines file written by spool_rows
+    """
+    with open(data_file, 'r') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def scan_spooled(data_file):
+    """
+        Return the header list and column widths of a JSON-lines file,
+        as spool_rows returned them when it was written
+    """
+    header_index = {}
+    widths = []
+    for item in iter_spooled(data_file):
+        track_columns(item, header_index, widths)
+    return list(header_index), widths
 
 
 def find_empty_slots(data):
@@ -286,66 +1026,6 @@ def find_empty_slots(data):
     return parsed_data
 
 
-def create_hyperlinks_sheet(file_name):
-    """
-        Create a Hyperlinks sheet pointing to all the Sheets in excel
-    """
-    sheet_name = "Hyperlinks"
-    workbook, sheet = get_excel(file_name, sheet_name)
-
-    # Set Header Row
-    sheet.cell(row=1, column=1, value="Hyperlinks")
-    cell = sheet.cell(row=1, column=1)
-    custom_font = Font(name='Calibri', size=18)  
-    blue_fill = PatternFill(start_color='66ccff', end_color='66ccff', fill_type='solid')
-    cell.font = custom_font
-    cell.fill = blue_fill
-
-    # Add Hyperlinks
-    sheets = workbook.sheetnames
-    if "Hyperlinks" in sheets:
-        sheets.remove('Hyperlinks')
-
-    for i,sheet_name in enumerate(sheets, start=2):
-        cell_font = Font(name="Calibri", underline="single", size=18, color="0066cc")
-        cell_value = sheet_name.upper()
-        link_value = f"#{sheet_name}!A{i}"
-        sheet.cell(row=i, column=1, value=cell_value).hyperlink = link_value
-        sheet.cell(row=i, column=1).font = cell_font
-
-    for column in sheet.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(cell.value)
-            except:
-                pass
-        adjusted_width = (max_length + 10)
-        sheet.column_dimensions[column_letter].width = adjusted_width
-    
-    # Save and close Workbook
-    workbook.save(file_name)
-    workbook.close()
-
-def set_default_sheet(file_name, sheet_name):
-    workbook = load_workbook(filename=file_name)
-
-    # Get the sheet's current position (index)
-    sheet_index = workbook.sheetnames.index(sheet_name)
-    new_position = - sheet_index
-    
-    # Move sheet to Index 0
-    workbook.move_sheet(sheet_name, new_position)
-
-    # Set Active sheet
-    workbook.active = workbook[sheet_name]
-
-    # Save the changes
-    workbook.save(file_name) 
-    workbook.close()
-
 def get_licenses(data):
     """
         Get Server Licenses
@@ -395,21 +1075,40 @@ def get_sp_policies(data):
         sp_data.append(sp_dict)
     return sp_data
 
-def get_vnic_ethifs(client_id, client_secret, token, fi_veth_data):
+def index_fi_interfaces(fi_data, id_key):
+    """
+        Index FI vEthernet/vFC records for the vNIC/vHBA correlation
+        Description is parsed once per record into the server serial and interface name
+        Returns two dicts:
+            (server serial, interface name, id) -> record, for associated profiles
+            (interface name, id) -> record, for unassociated profiles
+        When several records share a key, the last one wins
+    """
+    by_serial = {}
+    by_name = {}
+    for fi_if in fi_data:
+        server_serial = fi_if["Description"].split(":")[1]
+        if_name = (fi_if["Description"].split()[3]).split(",")[0]
+        by_serial[(server_serial, if_name, fi_if[id_key])] = fi_if
+        by_name[(if_name, fi_if[id_key])] = fi_if
+    return by_serial, by_name
+
+
+def get_vnic_ethifs(client_id, client_secret, token, fi_veth_data, api_url):
     """
         Get Virtual Ethernet Interfaces
+        api_url is the vnic/EthIfs query of projection.NESTED_QUERIES
     """
-    api_count_url = "https://intersight.com/api/v1/vnic/EthIfs?$filter=LcpVnic ne 'null'&$count=True"
-    api_url = "https://intersight.com/api/v1/vnic/EthIfs?$filter=LcpVnic ne 'null'&$expand=Profile($select=Name,AssociatedServer%3B$expand=AssociatedServer($select=Name,Model,Serial)),EthQosPolicy($select=Mtu,Cos,Priority),FabricEthNetworkGroupPolicy($select=VlanSettings),LcpVnic($select=LanConnectivityPolicy%3B$expand=LanConnectivityPolicy($select=Name))&$select=Name,MacAddress,FailoverEnabled,VifId,StandbyVifId,Placement,Profile,EthQosPolicy,FabricEthNetworkGroupPolicy,LcpVnic"
 
     # Intersight API Nested Data        
-    data = get_data(client_id, client_secret, token, api_count_url, api_url)
+    data = get_data(client_id, client_secret, token, None, api_url)
     
     if data:
-        # Flattened Data
-        semi_parsed_data = parse_data(data)
-        # Remove Parameters from Parsed Data before Writing
-        parsed_data = remove_parameters(semi_parsed_data)
+        # Flattened Data, Default parameters never built
+        parsed_data = flatten_rows(data)
+
+    # FI vEthernets indexed once, one lookup per vNIC
+    veth_by_serial, veth_by_name = index_fi_interfaces(fi_veth_data, "VethId")
 
     vnic_data = []
     for vnic in parsed_data:
@@ -436,65 +1135,51 @@ def get_vnic_ethifs(client_id, client_secret, token, fi_veth_data):
         vnic_dict["Profile_Name"]          = vnic["Profile_Name"]
         vnic_dict["StandbyVifId"]          = vnic["StandbyVifId"]
         vnic_dict["VifId"]                 = vnic["VifId"]
-        for veth in fi_veth_data:
-            server_serial = veth["Description"].split(":")[1]
-            vnic_name = (veth["Description"].split()[3]).split(",")[0]
-            if "Profile_AssociatedServer" not in vnic.keys():
-                if (vnic["Profile_AssociatedServer_Serial"] == server_serial) and (vnic["Name"] == vnic_name) and (veth["VethId"] == vnic["VifId"]):
-                    vnic_dict["AssociatedServer_Model"]  = vnic["Profile_AssociatedServer_Model"]
-                    vnic_dict["AssociatedServer_Name"]   = vnic["Profile_AssociatedServer_Name"]
-                    vnic_dict["AssociatedServer_Serial"] = vnic["Profile_AssociatedServer_Serial"]
-                    vnic_dict["BoundInterfaceDn"]        = veth["BoundInterfaceDn"]
-                    vnic_dict["Veth_Description"]        = veth["Description"]
-                    vnic_dict["FI_AdminEvacState"]       = veth["NetworkElement_AdminEvacState"]
-                    vnic_dict["FI_ManagementMode"]       = veth["NetworkElement_ManagementMode"]
-                    vnic_dict["FI_Model"]                = veth["NetworkElement_Model"]
-                    vnic_dict["FI_OperEvacState"]        = veth["NetworkElement_OperEvacState"]
-                    vnic_dict["FI_Operability"]          = veth["NetworkElement_Operability"]
-                    vnic_dict["FI_Serial"]               = veth["NetworkElement_Serial"]
-                    vnic_dict["FI_SwitchId"]             = veth["NetworkElement_SwitchId"]
-                    vnic_dict["FI_SwitchProfileName"]    = veth["NetworkElement_SwitchProfileName"]
-                    vnic_dict["OperReason"]              = veth["OperReason"]
-                    vnic_dict["OperState"]               = veth["OperState"]
-                    vnic_dict["PinnedInterfaceDn"]       = veth["PinnedInterfaceDn"]
-                    vnic_dict["VethId"]                  = veth["VethId"]
-            else:
-                if (vnic["Name"] == vnic_name) and (veth["VethId"] == vnic["VifId"]):
-                    vnic_dict["AssociatedServer_Model"]  = ""
-                    vnic_dict["AssociatedServer_Name"]   = ""
-                    vnic_dict["AssociatedServer_Serial"] = ""
-                    vnic_dict["BoundInterfaceDn"]        = veth["BoundInterfaceDn"]
-                    vnic_dict["Veth_Description"]        = veth["Description"]
-                    vnic_dict["FI_AdminEvacState"]       = veth["NetworkElement_AdminEvacState"]
-                    vnic_dict["FI_ManagementMode"]       = veth["NetworkElement_ManagementMode"]
-                    vnic_dict["FI_Model"]                = veth["NetworkElement_Model"]
-                    vnic_dict["FI_OperEvacState"]        = veth["NetworkElement_OperEvacState"]
-                    vnic_dict["FI_Operability"]          = veth["NetworkElement_Operability"]
-                    vnic_dict["FI_Serial"]               = veth["NetworkElement_Serial"]
-                    vnic_dict["FI_SwitchId"]             = veth["NetworkElement_SwitchId"]
-                    vnic_dict["FI_SwitchProfileName"]    = veth["NetworkElement_SwitchProfileName"]
-                    vnic_dict["OperReason"]              = veth["OperReason"]
-                    vnic_dict["OperState"]               = veth["OperState"]
-                    vnic_dict["PinnedInterfaceDn"]       = veth["PinnedInterfaceDn"]
-                    vnic_dict["VethId"]                  = veth["VethId"]
+        if "Profile_AssociatedServer" not in vnic.keys():
+            veth = veth_by_serial.get((vnic["Profile_AssociatedServer_Serial"], vnic["Name"], vnic["VifId"]))
+            if veth:
+                vnic_dict["AssociatedServer_Model"]  = vnic["Profile_AssociatedServer_Model"]
+                vnic_dict["AssociatedServer_Name"]   = vnic["Profile_AssociatedServer_Name"]
+                vnic_dict["AssociatedServer_Serial"] = vnic["Profile_AssociatedServer_Serial"]
+        else:
+            veth = veth_by_name.get((vnic["Name"], vnic["VifId"]))
+            if veth:
+                vnic_dict["AssociatedServer_Model"]  = ""
+                vnic_dict["AssociatedServer_Name"]   = ""
+                vnic_dict["AssociatedServer_Serial"] = ""
+        if veth:
+            vnic_dict["BoundInterfaceDn"]        = veth["BoundInterfaceDn"]
+            vnic_dict["Veth_Description"]        = veth["Description"]
+            vnic_dict["FI_AdminEvacState"]       = veth["NetworkElement_AdminEvacState"]
+            vnic_dict["FI_ManagementMode"]       = veth["NetworkElement_ManagementMode"]
+            vnic_dict["FI_Model"]                = veth["NetworkElement_Model"]
+            vnic_dict["FI_OperEvacState"]        = veth["NetworkElement_OperEvacState"]
+            vnic_dict["FI_Operability"]          = veth["NetworkElement_Operability"]
+            vnic_dict["FI_Serial"]               = veth["NetworkElement_Serial"]
+            vnic_dict["FI_SwitchId"]             = veth["NetworkElement_SwitchId"]
+            vnic_dict["FI_SwitchProfileName"]    = veth["NetworkElement_SwitchProfileName"]
+            vnic_dict["OperReason"]              = veth["OperReason"]
+            vnic_dict["OperState"]               = veth["OperState"]
+            vnic_dict["PinnedInterfaceDn"]       = veth["PinnedInterfaceDn"]
+            vnic_dict["VethId"]                  = veth["VethId"]
         vnic_data.append(vnic_dict)
     return vnic_data
 
-def get_vhba_fcifs(client_id, client_secret, token, fi_vfc_data):
+def get_vhba_fcifs(client_id, client_secret, token, fi_vfc_data, api_url):
     """
         Get vHBA Interfaces
+        api_url is the vnic/FcIfs query of projection.NESTED_QUERIES
     """
-    api_count_url = "https://intersight.com/api/v1/vnic/FcIfs?$filter=ScpVhba ne 'null'&$count=True"
-    api_url = "https://intersight.com/api/v1/vnic/FcIfs?$filter=ScpVhba ne 'null'&$expand=FcAdapterPolicy($select=IoThrottleCount,LunCount,LunQueueDepth),FcNetworkPolicy($select=Name,VsanSettings),WwpnPool($select=Name),FcQosPolicy($select=Burst,Cos,Name,Priority,RateLimit),Profile($select=Name,AssociatedServer%3B$expand=AssociatedServer($select=Name,Model,Serial)),ScpVhba($select=SanConnectivityPolicy%3B$expand=SanConnectivityPolicy($select=Name))&$select=Name,Order,Placement,FcAdapterPolicy,FcNetworkPolicy,FcQosPolicy,Profile,ScpVhba,Type,VifId,Wwpn,WwpnAddressType,WwpnPool"
 
     # Intersight API Nested Data        
-    data = get_data(client_id, client_secret, token, api_count_url, api_url)
+    data = get_data(client_id, client_secret, token, None, api_url)
     
     if data:
-        # Flattened Data
-        semi_parsed_data = parse_data(data)
-        # Remove Parameters from Parsed Data before Writing
-        parsed_data = remove_parameters(semi_parsed_data)
+        # Flattened Data, Default parameters never built
+        parsed_data = flatten_rows(data)
+
+        # FI vFCs indexed once, one lookup per vHBA
+        vfc_by_serial, vfc_by_name = index_fi_interfaces(fi_vfc_data, "VfcId")
 
         vhba_data = []
         for vhba in parsed_data:
@@ -531,42 +1216,25 @@ def get_vhba_fcifs(client_id, client_secret, token, fi_vfc_data):
                 vhba_dict["AssociatedServer_Model"]  = ""
                 vhba_dict["AssociatedServer_Name"]   = ""
                 vhba_dict["AssociatedServer_Serial"] = ""
-            for vfc in fi_vfc_data:
-                server_serial = vfc["Description"].split(":")[1]
-                vhba_name = (vfc["Description"].split()[3]).split(",")[0]
-                if "Profile_AssociatedServer" not in vhba.keys():
-                    if (vhba["Profile_AssociatedServer_Serial"] == server_serial) and (vhba["Name"] == vhba_name) and (vfc["VfcId"] == vhba["VifId"]):
-                        vhba_dict["BoundInterfaceDn"]     = vfc["BoundInterfaceDn"]
-                        vhba_dict["Description"]          = vfc["Description"]
-                        vhba_dict["Moid"]                 = vfc["Moid"]
-                        vhba_dict["FI_AdminEvacState"]    = vfc["NetworkElement_AdminEvacState"]
-                        vhba_dict["FI_ManagementMode"]    = vfc["NetworkElement_ManagementMode"]
-                        vhba_dict["FI_Model"]             = vfc["NetworkElement_Model"]
-                        vhba_dict["FI_OperEvacState"]     = vfc["NetworkElement_OperEvacState"]
-                        vhba_dict["FI_Operability"]       = vfc["NetworkElement_Operability"]
-                        vhba_dict["FI_Serial"]            = vfc["NetworkElement_Serial"]
-                        vhba_dict["FI_SwitchId"]          = vfc["NetworkElement_SwitchId"]
-                        vhba_dict["FI_SwitchProfileName"] = vfc["NetworkElement_SwitchProfileName"]
-                        vhba_dict["OperReason"]           = vfc["OperReason"]
-                        vhba_dict["OperState"]            = vfc["OperState"]
-                        vhba_dict["PinnedInterfaceDn"]    = vfc["PinnedInterfaceDn"]
-                        vhba_dict["VfcId"]                = vfc["VfcId"]
-                else:
-                    if (vhba["Name"] == vhba_name) and (vfc["VfcId"] == vhba["VifId"]):
-                        vhba_dict["BoundInterfaceDn"]     = vfc["BoundInterfaceDn"]
-                        vhba_dict["Description"]          = vfc["Description"]
-                        vhba_dict["Moid"]                 = vfc["Moid"]
-                        vhba_dict["FI_AdminEvacState"]    = vfc["NetworkElement_AdminEvacState"]
-                        vhba_dict["FI_ManagementMode"]    = vfc["NetworkElement_ManagementMode"]
-                        vhba_dict["FI_Model"]             = vfc["NetworkElement_Model"]
-                        vhba_dict["FI_OperEvacState"]     = vfc["NetworkElement_OperEvacState"]
-                        vhba_dict["FI_Operability"]       = vfc["NetworkElement_Operability"]
-                        vhba_dict["FI_Serial"]            = vfc["NetworkElement_Serial"]
-                        vhba_dict["FI_SwitchId"]          = vfc["NetworkElement_SwitchId"]
-                        vhba_dict["FI_SwitchProfileName"] = vfc["NetworkElement_SwitchProfileName"]
-                        vhba_dict["OperReason"]           = vfc["OperReason"]
-                        vhba_dict["OperState"]            = vfc["OperState"]
-                        vhba_dict["PinnedInterfaceDn"]    = vfc["PinnedInterfaceDn"]
-                        vhba_dict["VfcId"]                = vfc["VfcId"]
+            if "Profile_AssociatedServer" not in vhba.keys():
+                vfc = vfc_by_serial.get((vhba["Profile_AssociatedServer_Serial"], vhba["Name"], vhba["VifId"]))
+            else:
+                vfc = vfc_by_name.get((vhba["Name"], vhba["VifId"]))
+            if vfc:
+                vhba_dict["BoundInterfaceDn"]     = vfc["BoundInterfaceDn"]
+                vhba_dict["Description"]          = vfc["Description"]
+                vhba_dict["Moid"]                 = vfc["Moid"]
+                vhba_dict["FI_AdminEvacState"]    = vfc["NetworkElement_AdminEvacState"]
+                vhba_dict["FI_ManagementMode"]    = vfc["NetworkElement_ManagementMode"]
+                vhba_dict["FI_Model"]             = vfc["NetworkElement_Model"]
+                vhba_dict["FI_OperEvacState"]     = vfc["NetworkElement_OperEvacState"]
+                vhba_dict["FI_Operability"]       = vfc["NetworkElement_Operability"]
+                vhba_dict["FI_Serial"]            = vfc["NetworkElement_Serial"]
+                vhba_dict["FI_SwitchId"]          = vfc["NetworkElement_SwitchId"]
+                vhba_dict["FI_SwitchProfileName"] = vfc["NetworkElement_SwitchProfileName"]
+                vhba_dict["OperReason"]           = vfc["OperReason"]
+                vhba_dict["OperState"]            = vfc["OperState"]
+                vhba_dict["PinnedInterfaceDn"]    = vfc["PinnedInterfaceDn"]
+                vhba_dict["VfcId"]                = vfc["VfcId"]
             vhba_data.append(vhba_dict)
         return vhba_data
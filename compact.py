@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+    Compact storage for flattened rows
+    A dataset keeps one tuple per row instead of one dict per row. Rows with
+    the same keys in the same order share a single layout, and repeated string
+    values (Presence, OperState, Model, Vendor, Parent_Moid, ...) are interned,
+    so every row points at one copy of each value
+"""
+from collections.abc import Mapping
+
+
+class Layout:
+    """
+        Key order shared by all the rows with the same keys
+    """
+    __slots__ = ("names", "index")
+
+    def __init__(self, names):
+        self.names = names
+        self.index = {name: position for position, name in enumerate(names, start=1)}
+
+
+class CompactRow(Mapping):
+    """
+        Read-only dict view of one stored row
+        Keys, key order and values are exactly those of the row that was added
+    """
+    __slots__ = ("layout", "row")
+
+    def __init__(self, layout, row):
+        self.layout = layout
+        self.row = row
+
+    def __getitem__(self, key):
+        return self.row[self.layout.index[key]]
+
+    def get(self, key, default=None):
+        position = self.layout.index.get(key)
+        if position is None:
+            return default
+        return self.row[position]
+
+    def __contains__(self, key):
+        return key in self.layout.index
+
+    def __iter__(self):
+        return iter(self.layout.names)
+
+    def __len__(self):
+        return len(self.layout.names)
+
+    def items(self):
+        return zip(self.layout.names, self.row[1:])
+
+    def values(self):
+        return self.row[1:]
+
+    def to_dict(self):
+        return dict(zip(self.layout.names, self.row[1:]))
+
+
+class CompactRows:
+    """
+        Dataset of flattened rows, a drop-in for a list of row dicts where rows are only read
+        Iterating yields CompactRow views; slicing returns plain dicts, e.g. for pickling
+        columns lists every key in first-seen order, the same as get_header_list
+    """
+    def __init__(self, rows=()):
+        self.columns = []
+        self.layouts = {}
+        self.strings = {}
+        self.rows = []
+        self.extend(rows)
+
+    def append(self, item):
+        names = tuple(item)
+        layout = self.layouts.get(names)
+        if layout is None:
+            layout = self.add_layout(names)
+        strings = self.strings
+        row = [layout]
+        for value in item.values():
+            if type(value) is str:
+                value = strings.setdefault(value, value)
+            row.append(value)
+        self.rows.append(tuple(row))
+
+    def extend(self, rows):
+        for item in rows:
+            self.append(item)
+
+    def add_layout(self, names):
+        """
+            Register a new key order, names are interned like values
+        """
+        names = tuple(self.strings.setdefault(name, name) for name in names)
+        layout = Layout(names)
+        self.layouts[names] = layout
+        seen = set(self.columns)
+        self.columns.extend(name for name in names if name not in seen)
+        return layout
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        for row in self.rows:
+            yield CompactRow(row[0], row)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [CompactRow(row[0], row).to_dict() for row in self.rows[index]]
+        row = self.rows[index]
+        return CompactRow(row[0], row)
@@ -3,113 +3,944 @@
     Create Intersight Inventory.xlsx file
     Creates separate sheets for each component
     Components:
-        FI, 
+        FI,
         Chassis, IOM, x-fabric_modules, PCI Nodes
-        PSU, Fan Modules, FANs, 
+        PSU, Fan Modules, FANs,
         Server, CPU, Memory, Network Adapters, Storage Controllers
             Physical Drive, Virtual Drive, TPM, PCI Devices
 
 """
 import os
+import sys
 import json
+import argparse
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pprint import pprint
 from dotenv import load_dotenv, find_dotenv
-from common import get_token, get_data, parse_data
-from common import write_to_excel, remove_parameters, auto_size_columns
-from common import find_empty_slots, create_hyperlinks_sheet, set_default_sheet
+from common import get_api_data, get_data, get_cursor_data, flatten_rows, dump_rows
+from common import get_header_list
+from common import iter_rows, spool_rows, iter_spooled, scan_spooled
+from common import find_empty_slots
 from common import get_licenses, get_sp_policies
 from common import get_vnic_ethifs, get_vhba_fcifs
+from common import set_page_workers, set_max_in_flight, set_response_cache
+from common import set_rate_limit, TokenManager, set_token_manager
+from common import set_run_metrics, set_base_url, BASE_URL, PAGE_SIZE
+from common import set_page_checkpoint
+from common import set_cpu_workers, map_rows
+from checkpoint import Checkpoint
+from projection import plan_projections, check_derived, NESTED_QUERIES, NESTED_CONSUMERS
+from metrics import RunMetrics
+from compact import CompactRows
+from topology import TopologyIndex, TOPOLOGY_SOURCES, SERVER_SHEETS, CHASSIS_SHEETS, get_parents
 
 load_dotenv(find_dotenv())
 
+# openpyxl (workbook), sqlite3 (snapshot) and the response cache are imported
+# where they are used, so --fetch-only and targeted runs start fast
+
+# Default number of endpoints fetched in parallel
+ENDPOINT_WORKERS = 4
+# Sheets whose transforms need the whole dataset, never streamed
+IN_MEMORY_SHEETS = ["Empty_Chassis_Slots", "Licenses", "ServerProfile_policies", "Vnics", "Vhbas"]
+# API paths fetched by a sheet transform, attributed to that sheet in the run metrics
+NESTED_PATHS = {k: v["path"] for k,v in NESTED_QUERIES.items()}
+
+# Directory for the workbook, the per-sheet data files and the run summary
+DATA_DIR = "./Data"
+# Default number of targets crawled in parallel worker processes
+TARGET_WORKERS = 4
+
+# Phase timings and API counters of this run
+run_metrics = RunMetrics()
+
+
+def get_api_url(base_path, endpoint):
+    """
+        Return the data URL for an intersight_urls.json entry
+    """
+    endpoint_path = endpoint['path']
+    query_parameters = endpoint['query_parameters']
+
+    if query_parameters != "":
+        api_url = f"{base_path}{endpoint_path}?{query_parameters}"
+    else:
+        api_url = f"{base_path}{endpoint_path}"
+    return api_url
+
+
+def get_cursor_ranges(endpoint):
+    """
+        Return the number of Moid ranges fetched in parallel for an entry with
+        "pagination": "cursor", or 0 for $top/$skip paging
+    """
+    if endpoint.get('pagination') != "cursor":
+        return 0
+    return max(1, int(endpoint.get('cursor_ranges', 1)))
+
+
+def get_summary_url(base_path, endpoint):
+    """
+        Return the $apply URL for a summary entry of intersight_urls.json
+        Other query parameters, e.g. $filter, are sent along with $apply
+    """
+    api_url = f"{base_path}{endpoint['path']}?$apply={endpoint['apply']}"
+    if endpoint.get('query_parameters'):
+        api_url = f"{api_url}&{endpoint['query_parameters']}"
+    return api_url
+
+
+def get_sources(endpoint):
+    """
+        Return the list of sheets a derived entry is computed from
+    """
+    sources = endpoint['derived_from']
+    if isinstance(sources, str):
+        sources = [sources]
+    return sources
+
+
+def merge_select(query_parameters, properties):
+    """
+        Add properties to the $select of query parameters
+        Queries without $select already return every property and are left as is
+        Returns the new query parameters and the properties that were added
+    """
+    params = query_parameters.split("&") if query_parameters else []
+    for i, param in enumerate(params):
+        if param.startswith("$select="):
+            selected = param[len("$select="):].split(",")
+            added = [p for p in properties if p not in selected]
+            params[i] = "$select=" + ",".join(selected + added)
+            return "&".join(params), added
+    return query_parameters, []
+
+
+def resolve_derived(json_data):
+    """
+        Resolve "derived_from" entries of intersight_urls.json
+        The "select" properties of each derived entry are merged into the
+        $select of its source entries, so every collection is downloaded once
+        Returns:
+            endpoints: entries to fetch, with merged query parameters
+            derived: derived sheet name -> list of source sheet names
+            strip: source sheet name -> properties added only for derived sheets
+    """
+    endpoints = {k: dict(v) for k,v in json_data.items() if "derived_from" not in v}
+    derived = {}
+    strip = {}
+    for k,v in json_data.items():
+        if "derived_from" not in v:
+            continue
+        derived[k] = get_sources(v)
+        properties = v.get("select", "").split(",") if v.get("select") else []
+        for source in derived[k]:
+            endpoint = endpoints[source]
+            endpoint['query_parameters'], added = merge_select(endpoint['query_parameters'], properties)
+            strip.setdefault(source, []).extend(added)
+    return endpoints, derived, strip
+
+
+def transform_rows(client_id, client_secret, token, sheet_name, parsed_data, nested_url=None):
+    """
+        Apply the sheet specific transform to flattened rows
+        nested_url is the planned NESTED_QUERIES URL the Vnics/Vhbas transforms fetch
+    """
+    if sheet_name == "Empty_Chassis_Slots":
+        parsed_data = find_empty_slots(parsed_data)
+
+    # Per-row transforms, run on the process pool for large datasets
+    if sheet_name == "Licenses":
+        parsed_data = map_rows(get_licenses, parsed_data)
+
+    if sheet_name == "ServerProfile_policies":
+        parsed_data = map_rows(get_sp_policies, parsed_data)
+
+    if sheet_name == "Vnics":
+        parsed_data = get_vnic_ethifs(client_id, client_secret, token, parsed_data, nested_url)
+
+    if sheet_name == "Vhbas":
+        parsed_data = get_vhba_fcifs(client_id, client_secret, token, parsed_data, nested_url)
+
+    return parsed_data
+
+
+def fetch_endpoint(client_id, client_secret, token, base_path, sheet_name, endpoint, snapshot_store=None, strip=None,
+                   keep_data=False, nested_url=None):
+    """
+        Fetch stage: get, flatten and transform the data for one endpoint
+        Vnics/Vhbas post-processing fetches nested_url, their planned vnic/EthIfs
+        or vnic/FcIfs query, here so those requests also run in the fetch stage
+        With a snapshot_store, the endpoint is delta-synced and read from the store
+        Properties in strip were only requested for derived sheets and are left
+        out of this sheet
+        Rows are flattened into CompactRows and the raw objects are dropped,
+        unless keep_data is set because a derived sheet needs them. Otherwise
+        the page workers flatten each page as it is decoded, no raw objects are kept
+        Returns the raw data (empty unless keep_data) and the sheet rows
+    """
+    api_url = get_api_url(base_path, endpoint)
+    cursor_ranges = get_cursor_ranges(endpoint)
+
+    with run_metrics.profile(sheet_name):
+        if snapshot_store is None and not strip and not keep_data:
+            # Pages are decoded and flattened as they arrive, timed as one fetch phase
+            with run_metrics.phase(sheet_name, "fetch"):
+                parsed_data = CompactRows(iter_rows(client_id, client_secret, token, api_url, cursor_ranges))
+            if not parsed_data:
+                return [], None
+            with run_metrics.phase(sheet_name, "transform"):
+                parsed_data = transform_rows(client_id, client_secret, token, sheet_name, parsed_data,
+                                             nested_url)
+            return [], parsed_data
+
+        with run_metrics.phase(sheet_name, "fetch"):
+            if snapshot_store is not None:
+                data = snapshot_store.sync_endpoint(client_id, client_secret, token, sheet_name, api_url,
+                                                    cursor_ranges)
+            elif cursor_ranges:
+                # Keyset pagination on Moid, optionally over parallel Moid ranges
+                data = get_cursor_data(client_id, client_secret, token, api_url, cursor_ranges)
+            else:
+                # Intersight API Nested Data, count taken from the first page
+                data = get_data(client_id, client_secret, token, None, api_url)
+        if not data:
+            return [], None
+
+        sheet_data = data
+        if strip:
+            sheet_data = [{k: v for k,v in item.items() if k not in strip} for item in data]
+
+        # Flattened Data, Default parameters dropped while flattening
+        with run_metrics.phase(sheet_name, "flatten"):
+            parsed_data = flatten_rows(sheet_data, compact=True)
+        sheet_data = None
+        if not keep_data:
+            data = []
+        with run_metrics.phase(sheet_name, "transform"):
+            parsed_data = transform_rows(client_id, client_secret, token, sheet_name, parsed_data, nested_url)
+    return data, parsed_data
+
+
+def fetch_summary(client_id, client_secret, token, base_path, sheet_name, endpoint):
+    """
+        Fetch stage for a summary entry: a grouped aggregation request,
+        Intersight returns the aggregated rows, never the detail objects
+        The rows are paged with $top/$skip like a collection, a page shorter
+        than PAGE_SIZE is the last one
+        Returns no raw data and the sheet rows, like fetch_endpoint
+    """
+    api_url = get_summary_url(base_path, endpoint)
+
+    results = []
+    with run_metrics.phase(sheet_name, "fetch"):
+        while True:
+            response = get_api_data(client_id, client_secret, token,
+                                    f"{api_url}&$top={PAGE_SIZE}&$skip={len(results)}")
+            page = response.get("Results") or []
+            results.extend(page)
+            if len(page) < PAGE_SIZE:
+                break
+    if not results:
+        return [], None
+    with run_metrics.phase(sheet_name, "flatten"):
+        parsed_data = flatten_rows(results)
+    return [], parsed_data
+
+
+def spool_endpoint(client_id, client_secret, token, base_path, sheet_name, endpoint):
+    """
+        Streaming fetch stage: each page is flattened and appended to
+        <DATA_DIR>/<sheet_name>.jsonl as it arrives, so only a few pages are held in memory
+        Returns the data file, header list and column widths for the writer stage
+    """
+    api_url = get_api_url(base_path, endpoint)
+    rows = iter_rows(client_id, client_secret, token, api_url, get_cursor_ranges(endpoint))
+
+    data_file = f"{DATA_DIR}/{sheet_name}.jsonl"
+    # Fetch, flatten and the JSON-lines write are interleaved, timed as one fetch phase
+    with run_metrics.profile(sheet_name), run_metrics.phase(sheet_name, "fetch"):
+        header_list, widths, count = spool_rows(rows, data_file)
+    if not count:
+        return None
+    return data_file, header_list, widths
+
+
+def write_sheet(workbook_session, sheet_name, parsed_data):
+    """
+        Writer stage: write one dataset to its JSON file and Excel sheet
+        Without a workbook_session only the JSON file is written
+        Returns the JSON file name
+    """
+    # Create Data json file
+    data_file = f"{DATA_DIR}/{sheet_name}.json"
+    with run_metrics.phase(sheet_name, "json"):
+        with open(data_file, 'w') as f:
+            dump_rows(parsed_data, f)
+
+    if workbook_session is None:
+        return data_file
+
+    print(f"Creating Sheet: {sheet_name}")
+    with run_metrics.phase(sheet_name, "write"):
+        header_list = get_header_list(parsed_data)
+
+        # Add sheet to the in-memory workbook, column widths tracked while writing
+        workbook_session.add_sheet(sheet_name, header_list, parsed_data)
+    return data_file
+
+
+def load_sheet(workbook_session, sheet_name, entry):
+    """
+        Writer stage for a sheet written by an earlier run (--resume, --render-only)
+        Its rows are read back from the data file, a .jsonl entry also has
+        the header_list and widths of the file
+        Returns the data file, None if the sheet had no data
+    """
+    data_file = entry["data_file"]
+    if data_file is None or workbook_session is None:
+        return data_file
+
+    print(f"Creating Sheet: {sheet_name} (from {data_file})")
+    with run_metrics.phase(sheet_name, "write"):
+        if data_file.endswith(".jsonl"):
+            workbook_session.stream_sheet(sheet_name, entry["header_list"], iter_spooled(data_file), entry["widths"])
+        else:
+            with open(data_file, 'r') as f:
+                parsed_data = json.load(f)
+            workbook_session.add_sheet(sheet_name, get_header_list(parsed_data), parsed_data)
+    return data_file
+
+
+def index_topology(topology, sheets, futures, streamed, fetched):
+    """
+        Index the TOPOLOGY_SOURCES in sheets and, in turn, the sources their
+        own rows point to, e.g. Memory_array -> Motherboards -> Blades -> Chassis
+        Only those are waited for, the other fetches keep being written as they finish
+        Sources fetched by this run are taken from their fetch results, a
+        source already written without data is indexed empty. The others
+        (resumed or not selected) are read from the data files of an earlier run
+    """
+    pending = list(sheets)
+    visited = set()
+    missing = []
+    while pending:
+        source = pending.pop()
+        if source in visited:
+            continue
+        visited.add(source)
+        if source not in topology.parents:
+            rows = []
+            if source in futures:
+                result = futures[source].result()
+                if source in streamed:
+                    rows = iter_spooled(result[0]) if result else []
+                else:
+                    rows = result[1] or []
+            elif source not in fetched:
+                data_file = find_data_file(DATA_DIR, source)
+                if data_file is None:
+                    missing.append(source)
+                else:
+                    rows = iter_data_file(data_file)
+            topology.add(source, rows)
+        pending.extend(topology.parents[source])
+    if missing:
+        print(f"-> Topology: no data file for {', '.join(missing)}, their components are not attributed")
+
+
+def attribute_rows(topology, sheet_name, get_rows, futures, streamed, fetched):
+    """
+        Return the rows of a sheet with the server, chassis and domain of their
+        parent added, or None for a sheet without Parent_Moid
+        get_rows returns a new iterator over the rows of the sheet
+        A source sheet is indexed as it is written. Before its rows are
+        attributed, the sources their parents are in are indexed, e.g. Memory
+        waits for Memory_array, written after it
+    """
+    if sheet_name in TOPOLOGY_SOURCES:
+        topology.add(sheet_name, get_rows())
+    if sheet_name in SERVER_SHEETS or sheet_name in CHASSIS_SHEETS:
+        return None
+    for item in get_rows():
+        if "Parent_Moid" not in item:
+            return None
+        break
+    if sheet_name in TOPOLOGY_SOURCES:
+        parents = topology.parents[sheet_name]
+    else:
+        parents = get_parents(get_rows())
+    index_topology(topology, parents, futures, streamed, fetched)
+    return topology.enrich(get_rows())
+
+
+def find_data_file(data_dir, sheet_name):
+    """
+        Return the data file of a sheet in data_dir, None if there is none
+        When both exist, the newer of <sheet>.json and <sheet>.jsonl (Streaming) is used
+    """
+    data_files = [f"{data_dir}/{sheet_name}.json", f"{data_dir}/{sheet_name}.jsonl"]
+    data_files = [data_file for data_file in data_files if os.path.isfile(data_file)]
+    if not data_files:
+        return None
+    return max(data_files, key=os.path.getmtime)
+
+
+def select_sheets(json_data, only=None, exclude=None, dependencies=True):
+    """
+        Return the intersight_urls.json entries selected with --only/--exclude,
+        in intersight_urls.json order
+        With dependencies, the sources of selected derived sheets are added,
+        even when excluded. API paths fetched by a transform (NESTED_PATHS)
+        are always fetched with their sheet
+    """
+    selected = [k for k in json_data if (not only or k in only) and k not in (exclude or [])]
+    needed = set(selected)
+    if dependencies:
+        for k in selected:
+            if "derived_from" in json_data[k]:
+                needed.update(get_sources(json_data[k]))
+        added = [k for k in json_data if k in needed and k not in selected]
+        if added:
+            print(f"-> Including {', '.join(added)}, needed by the selected derived sheets")
+        for k in selected:
+            if k in NESTED_PATHS:
+                print(f"-> {k} also fetches {NESTED_PATHS[k]}")
+    return {k: v for k,v in json_data.items() if k in needed}
+
+
+def apply_settings():
+    """
+        Apply the .env concurrency, rate and CPU pool settings to the common helpers
+    """
+    page_workers = os.getenv("PageWorkers")
+    max_in_flight = os.getenv("MaxInFlight")
+    rate_limit = os.getenv("RateLimit")
+    cpu_workers = os.getenv("CpuWorkers")
+
+    # Number of pages fetched in parallel per endpoint
+    if page_workers:
+        set_page_workers(page_workers)
+
+    # Cap on API requests in flight across all endpoints
+    if max_in_flight:
+        set_max_in_flight(max_in_flight)
+
+    # Starting and maximum request rate, adapted at runtime from 429s
+    if rate_limit:
+        set_rate_limit(rate_limit, os.getenv("MaxRateLimit"))
+
+    # Process pool for flattening and per-row transforms of large endpoints
+    if cpu_workers:
+        set_cpu_workers(cpu_workers)
+
+
+def get_tenant_path(path, tenant, directory=False):
+    """
+        Return a per-tenant variant of a file or directory setting
+        e.g. ./.token -> ./.token.<tenant>, ./Data/cache -> ./Data/cache/<tenant>
+    """
+    if not path or not tenant:
+        return path
+    if directory:
+        return os.path.join(path, tenant)
+    return f"{path}.{tenant}"
+
+
+def build_report(json_data, client_id, client_secret, base_url, data_dir="./Data", tenant=None, workbook=True,
+                 resume=False, update=False, file_name=None):
+    """
+        Crawl one Intersight account or appliance into data_dir
+        Writes a JSON data file per sheet, run_stats.json and, with workbook=True,
+        <data_dir>/Inventory.xlsx, or <data_dir>/Summary.xlsx with SummaryOnly=true
+        With update=True the sheets are replaced in an existing workbook and
+        its other sheets are kept, for a run of selected sheets
+        file_name writes the workbook elsewhere, e.g. only the selected sheets
+        For a tenant, the token file, cache directory and snapshot database get
+        a per-tenant name so accounts on the same URL never share them
+        Finished sheets, and fetched pages with CheckpointPages=true, are checkpointed in <data_dir>/checkpoint,
+        with resume=True only what an earlier run did not finish is fetched
+        Returns sheet name -> data file, in intersight_urls.json order
+    """
+    global DATA_DIR
+    DATA_DIR = data_dir
+    endpoint_workers = int(os.getenv("EndpointWorkers", ENDPOINT_WORKERS))
+    streaming = os.getenv("Streaming", "").lower() in ["1", "true", "yes"]
+    use_cache = os.getenv("Cache", "").lower() in ["1", "true", "yes"]
+    offline = os.getenv("Offline", "").lower() in ["1", "true", "yes"]
+    sync = os.getenv("Sync", "").lower() in ["1", "true", "yes"]
+    run_stats_sheet = os.getenv("RunStatsSheet", "").lower() in ["1", "true", "yes"]
+    profile = os.getenv("Profile", "").lower() in ["1", "true", "yes"]
+    summary_only = os.getenv("SummaryOnly", "").lower() in ["1", "true", "yes"]
+    use_checkpoint = os.getenv("Checkpoint", "true").lower() in ["1", "true", "yes"]
+    checkpoint_pages = os.getenv("CheckpointPages", "").lower() in ["1", "true", "yes"]
+    use_topology = os.getenv("Topology", "true").lower() in ["1", "true", "yes"]
+    os.makedirs(data_dir, exist_ok=True)
+
+    # Summary entries ("apply") are aggregated by Intersight, in summary only
+    # mode the detail collections are never downloaded
+    summaries = {k: v for k,v in json_data.items() if "apply" in v}
+    if summary_only:
+        json_data = summaries
+    details = {k: v for k,v in json_data.items() if k not in summaries}
+
+    # Per-endpoint API counters and phase timings
+    set_run_metrics(run_metrics)
+    if profile:
+        run_metrics.enable_profiling(f"{data_dir}/profiles")
+
+    # Intersight URL, e.g. an appliance or the benchmark mock server
+    base_url = base_url.rstrip("/")
+    set_base_url(base_url)
+    base_path = f"{base_url}/api/v1/"
+
+    # Response cache, TTL per endpoint from cache_ttl in intersight_urls.json
+    if use_cache or offline:
+        from cache import ResponseCache
+        cache_dir = get_tenant_path(os.getenv("CacheDir"), tenant, directory=True) or f"{data_dir}/cache"
+        response_cache = ResponseCache(cache_dir=cache_dir,
+                                       max_size=int(os.getenv("CacheMaxSizeMB", 500)) * 1024 * 1024,
+                                       default_ttl=int(os.getenv("CacheTTL", 0)),
+                                       offline=offline)
+        for k,v in json_data.items():
+            if "cache_ttl" in v and k in summaries:
+                response_cache.set_ttl(f"{base_path}{v['path']}?$apply", v["cache_ttl"])
+            elif "cache_ttl" in v and "path" in v:
+                response_cache.set_ttl(f"{base_path}{v['path']}", v["cache_ttl"])
+        set_response_cache(response_cache)
+
+    # Get oAuth Token, not needed when replaying from the cache
+    # The TokenManager refreshes it before expiry for all workers
+    token = None
+    if not offline:
+        token_manager = TokenManager(client_id, client_secret,
+                                     token_file=get_tenant_path(os.getenv("TokenFile"), tenant))
+        set_token_manager(token_manager)
+        token = token_manager.get_token()
+
+    # Sheets computed from already fetched datasets
+    check_derived(details)
+    endpoints, derived, strip = resolve_derived(details)
+
+    # Minimal $select/$expand for sheets built by a transform, and for the queries a transform fetches
+    endpoints = plan_projections(endpoints)
+    nested_urls = {k: get_api_url(base_path, v)
+                   for k,v in plan_projections(NESTED_QUERIES, NESTED_CONSUMERS).items() if k in endpoints}
+
+    for k,v in endpoints.items():
+        run_metrics.register(k, f"{base_path}{v['path']}")
+    for k,path in NESTED_PATHS.items():
+        run_metrics.register(k, f"{base_path}{path}")
+    for k,v in summaries.items():
+        run_metrics.register(k, f"{base_path}{v['path']}?$apply")
+
+    if file_name is None:
+        file_name = f"{data_dir}/Summary.xlsx" if summary_only else f"{data_dir}/Inventory.xlsx"
+    # Delta sync into the local snapshot store, workbook built from the store
+    snapshot_store = None
+    if sync:
+        from snapshot import SnapshotStore
+        snapshot_store = SnapshotStore(get_tenant_path(os.getenv("SnapshotDb"), tenant) or f"{data_dir}/snapshot.db")
+
+    # Raw objects are only kept for the sources of derived sheets
+    sources = set(source for v in derived.values() for source in v)
+
+    # Checkpoint of finished sheets, keyed by their query, and with CheckpointPages=true of fetched pages
+    # Offline runs only read the cache, there is nothing to checkpoint
+    checkpoint = None
+    if use_checkpoint and not offline:
+        checkpoint = Checkpoint(f"{data_dir}/checkpoint", resume=resume, pages=checkpoint_pages)
+    set_page_checkpoint(checkpoint if checkpoint_pages else None)
+    sheet_keys = {k: get_summary_url(base_path, v) for k,v in summaries.items()}
+    sheet_keys.update((k, get_api_url(base_path, v)) for k,v in endpoints.items())
+    sheet_keys.update((k, f"{sheet_keys[k]} {v}") for k,v in nested_urls.items())
+    sheet_keys.update((k, " ".join(sheet_keys[source] for source in v)) for k,v in derived.items())
+    resumed = {}
+    if checkpoint is not None:
+        for k in json_data:
+            entry = checkpoint.get_sheet(k, sheet_keys[k])
+            if entry is not None:
+                resumed[k] = entry
+        # A source is fetched again while one of its derived sheets is missing, they need its raw objects
+        for k,v in derived.items():
+            if k not in resumed:
+                for source in v:
+                    resumed.pop(source, None)
+        if resume:
+            print(f"-> Resuming: {len(resumed)} of {len(json_data)} sheets already done")
+
+    # Component rows get the server, chassis and domain owning them from a Moid
+    # index over the parent sheets, instead of an $expand on every component
+    topology = TopologyIndex() if use_topology and not summary_only else None
+
+    sheet_files = {}
+    with ThreadPoolExecutor(max_workers=endpoint_workers) as executor:
+        futures = {}
+        streamed = []
+        for k,v in summaries.items():
+            if k in resumed:
+                continue
+            futures[k] = executor.submit(fetch_summary, client_id, client_secret, token, base_path, k, v)
+        for k,v in endpoints.items():
+            if k in resumed:
+                continue
+            if streaming and not sync and k not in IN_MEMORY_SHEETS and k not in strip:
+                streamed.append(k)
+                futures[k] = executor.submit(spool_endpoint, client_id, client_secret, token, base_path, k, v)
+            else:
+                futures[k] = executor.submit(fetch_endpoint, client_id, client_secret, token, base_path, k, v,
+                                             snapshot_store, strip.get(k), k in sources, nested_urls.get(k))
+
+        # Sheets fetched by this run, the others are read back from their data files
+        fetched = set(futures)
+
+        # Streaming mode writes the workbook in openpyxl write-only mode
+        # An existing workbook being updated is loaded while the endpoints are fetched
+        workbook_session = None
+        if workbook:
+            from workbook import WorkbookSession
+            workbook_session = WorkbookSession(file_name, write_only=streaming, update=update)
+
+        # Write datasets in intersight_urls.json order as they finish,
+        # while the remaining endpoints are still being fetched
+        for k in json_data:
+            if k in resumed:
+                data_file = load_sheet(workbook_session, k, resumed[k])
+                if data_file is not None:
+                    sheet_files[k] = data_file
+                continue
+            if k in derived:
+                # Derived sheet: computed locally from the raw source datasets
+                data = []
+                for source in derived[k]:
+                    data.extend(futures[source].result()[0])
+                if data:
+                    with run_metrics.phase(k, "flatten"):
+                        parsed_data = flatten_rows(data)
+                    with run_metrics.phase(k, "transform"):
+                        parsed_data = transform_rows(client_id, client_secret, token, k, parsed_data)
+                    sheet_files[k] = write_sheet(workbook_session, k, parsed_data)
+                if checkpoint is not None:
+                    checkpoint.save_sheet(k, sheet_keys[k], sheet_files.get(k))
+                continue
+            # Written sheets are released, except the sources of derived sheets
+            result = futures[k].result() if k in sources else futures.pop(k).result()
+            if k in streamed:
+                if result:
+                    data_file, header_list, widths = result
+                    sheet_files[k] = data_file
+                    rows = None
+                    if topology is not None:
+                        rows = attribute_rows(topology, k, partial(iter_spooled, data_file), futures, streamed,
+                                              fetched)
+                    if rows is not None:
+                        # Spooled again with the owner columns, still one row at a time
+                        with run_metrics.phase(k, "transform"):
+                            header_list, widths, count = spool_rows(rows, f"{data_file}.tmp")
+                        os.replace(f"{data_file}.tmp", data_file)
+                    if workbook_session is not None:
+                        print(f"Creating Sheet: {k}")
+                        with run_metrics.phase(k, "write"):
+                            workbook_session.stream_sheet(k, header_list, iter_spooled(data_file), widths)
+                    if checkpoint is not None:
+                        checkpoint.save_sheet(k, sheet_keys[k], data_file, header_list=header_list, widths=widths)
+                elif checkpoint is not None:
+                    checkpoint.save_sheet(k, sheet_keys[k], None)
+            else:
+                parsed_data = result[1]
+                if parsed_data and topology is not None:
+                    rows = attribute_rows(topology, k, partial(iter, parsed_data), futures, streamed, fetched)
+                    if rows is not None:
+                        with run_metrics.phase(k, "transform"):
+                            parsed_data = CompactRows(rows)
+                if parsed_data:
+                    sheet_files[k] = write_sheet(workbook_session, k, parsed_data)
+                if checkpoint is not None:
+                    checkpoint.save_sheet(k, sheet_keys[k], sheet_files.get(k))
+
+    if snapshot_store is not None:
+        snapshot_store.close()
+
+    if workbook_session is not None:
+        # Run statistics sheet, next to Hyperlinks
+        if run_stats_sheet:
+            print(f"Creating Sheet: Run_Stats")
+            stats_rows = run_metrics.get_rows()
+            workbook_session.add_sheet("Run_Stats", get_header_list(stats_rows), stats_rows)
+
+        # Create Hyperlinks Sheet
+        print(f"Creating Sheet: Hyperlinks")
+        workbook_session.add_hyperlinks_sheet()
+
+        # Set Hyperlinks as Default Sheet
+        sheet_name = "Hyperlinks"
+        workbook_session.set_default_sheet(sheet_name)
+
+        # Write the workbook once
+        with run_metrics.phase("Workbook", "write"):
+            workbook_session.save()
+
+    # Every sheet is written, the saved pages are no longer needed
+    if checkpoint is not None:
+        checkpoint.finish()
+
+    # Run summary
+    run_metrics.finish_profiling()
+    run_metrics.save(f"{data_dir}/run_stats.json")
+    return sheet_files
+
+
+def render_report(json_data, data_dir="./Data", update=False, file_name=None):
+    """
+        Build the workbook from the data files of earlier runs (--render-only),
+        without contacting Intersight
+        With update=True only these sheets are replaced in an existing workbook
+        file_name writes the workbook elsewhere, e.g. only the selected sheets
+        Returns sheet name -> data file of the sheets written
+    """
+    from workbook import WorkbookSession
+    streaming = os.getenv("Streaming", "").lower() in ["1", "true", "yes"]
+    summary_only = os.getenv("SummaryOnly", "").lower() in ["1", "true", "yes"]
+    if summary_only:
+        json_data = {k: v for k,v in json_data.items() if "apply" in v}
+
+    if file_name is None:
+        file_name = f"{data_dir}/Summary.xlsx" if summary_only else f"{data_dir}/Inventory.xlsx"
+    workbook_session = WorkbookSession(file_name, write_only=streaming, update=update)
+    sheet_files = {}
+    for k in json_data:
+        data_file = find_data_file(data_dir, k)
+        if data_file is None:
+            print(f"-> {k}: no data file in {data_dir}, skipped", file=sys.stderr)
+            continue
+        entry = {"data_file": data_file}
+        if data_file.endswith(".jsonl"):
+            entry["header_list"], entry["widths"] = scan_spooled(data_file)
+        sheet_files[k] = load_sheet(workbook_session, k, entry)
+
+    print(f"Creating Sheet: Hyperlinks")
+    workbook_session.add_hyperlinks_sheet()
+    workbook_session.set_default_sheet("Hyperlinks")
+    workbook_session.save()
+    return sheet_files
+
+
+def load_targets(targets_file):
+    """
+        Read the list of targets to crawl
+        Each target has a name, a base_url and either client_id/client_secret
+        or client_id_env/client_secret_env naming the environment variables
+        holding them. rate_limit and max_rate_limit override the .env values
+    """
+    with open(targets_file, 'r') as f:
+        targets = json.load(f)
+    for target in targets:
+        target.setdefault("base_url", BASE_URL)
+        if "client_id_env" in target:
+            target["client_id"] = os.getenv(target["client_id_env"])
+        if "client_secret_env" in target:
+            target["client_secret"] = os.getenv(target["client_secret_env"])
+    return targets
+
+
+def crawl_target(json_data, target, workbook, resume=False, update=False):
+    """
+        Worker process: crawl one target into ./Data/<name> with its own
+        token, rate governor and metrics
+        Returns the sheet data files of the target
+    """
+    apply_settings()
+    if "rate_limit" in target:
+        set_rate_limit(target["rate_limit"], target.get("max_rate_limit"))
+    return build_report(json_data, target["client_id"], target["client_secret"], target["base_url"],
+                        data_dir=f"./Data/{target['name']}", tenant=target["name"], workbook=workbook,
+                        resume=resume, update=update)
+
+
+def iter_data_file(data_file):
+    """
+        Yield the rows of a .json or .jsonl sheet data file
+    """
+    if data_file.endswith(".jsonl"):
+        yield from iter_spooled(data_file)
+        return
+    with open(data_file, 'r') as f:
+        yield from json.load(f)
+
+
+def iter_tenant_rows(tenant_files):
+    """
+        Yield the rows of each tenant's data file with a leading Tenant column
+    """
+    for tenant, data_file in tenant_files:
+        for item in iter_data_file(data_file):
+            row = {"Tenant": tenant}
+            row.update(item)
+            yield row
+
+
+def merge_workbook(json_data, results, file_name="./Data/Inventory.xlsx", streaming=False, run_stats_sheet=False,
+                   update=False):
+    """
+        Build one workbook from the data files of every tenant,
+        each sheet prefixed with a Tenant column
+        Rows are spooled to ./Data/<sheet>.merged.jsonl, not held in memory, and the
+        file is deleted once the sheet is written. ./Data/<sheet>.json(l) stays the
+        data file of a single-target run
+        With update=True the sheets are replaced in an existing workbook
+    """
+    from workbook import WorkbookSession
+    workbook_session = WorkbookSession(file_name, write_only=streaming, update=update)
+    sheets = list(json_data) + (["Run_Stats"] if run_stats_sheet else [])
+    for k in sheets:
+        if k == "Run_Stats":
+            tenant_files = [(tenant, f"./Data/{tenant}/run_stats.json") for tenant in results]
+            stats_rows = []
+            for tenant, stats_file in tenant_files:
+                with open(stats_file, 'r') as f:
+                    stats_rows.extend({"Tenant": tenant, **row} for row in json.load(f)["endpoints"])
+            print(f"Creating Sheet: Run_Stats")
+            workbook_session.add_sheet("Run_Stats", get_header_list(stats_rows), stats_rows)
+            continue
+        tenant_files = [(tenant, sheet_files[k]) for tenant, sheet_files in results.items() if k in sheet_files]
+        if not tenant_files:
+            continue
+        spool_file = f"./Data/{k}.merged.jsonl"
+        header_list, widths, count = spool_rows(iter_tenant_rows(tenant_files), spool_file)
+        print(f"Creating Sheet: {k}")
+        workbook_session.stream_sheet(k, header_list, iter_spooled(spool_file), widths)
+        os.remove(spool_file)
+
+    print(f"Creating Sheet: Hyperlinks")
+    workbook_session.add_hyperlinks_sheet()
+    workbook_session.set_default_sheet("Hyperlinks")
+    workbook_session.save()
+
+
+def get_sheet_names(values, json_data):
+    """
+        Return the sheet names of comma separated --only/--exclude values,
+        matched case-insensitively against intersight_urls.json
+        Raises ValueError for an unknown sheet
+    """
+    names = {k.lower(): k for k in json_data}
+    sheet_names = []
+    for value in values or []:
+        for name in value.split(","):
+            name = name.strip()
+            if not name:
+                continue
+            if name.lower() not in names:
+                raise ValueError(f"unknown sheet {name}, expected one of: {', '.join(json_data)}")
+            sheet_names.append(names[name.lower()])
+    return sheet_names
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create the Intersight Inventory.xlsx workbook")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the last run from ./Data/checkpoint, only fetch what it did not finish")
+    parser.add_argument("--only", action="append", metavar="SHEETS",
+                        help="comma separated sheets to refresh, the other sheets of the workbook are kept")
+    parser.add_argument("--exclude", action="append", metavar="SHEETS",
+                        help="comma separated sheets to leave out, the workbook keeps their current version")
+    parser.add_argument("--output", metavar="FILE",
+                        help="write the selected sheets to a new workbook FILE instead of replacing them in "
+                             "./Data/Inventory.xlsx, which is loaded and saved again in full")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--fetch-only", action="store_true",
+                      help="only fetch the data files into ./Data, do not write the workbook")
+    mode.add_argument("--render-only", action="store_true",
+                      help="build the workbook from the data files in ./Data, without contacting Intersight")
+    args = parser.parse_args()
+
     # Set variables
     client_id = os.getenv("ClientId")
     client_secret = os.getenv("ClientSecret")
+    targets_file = os.getenv("Targets")
+    checkpointed = (os.getenv("Checkpoint", "true").lower() in ["1", "true", "yes"] and
+                    os.getenv("Offline", "").lower() not in ["1", "true", "yes"])
 
-    # Get oAuth Token
-    token = get_token(client_id, client_secret)
-
-    with open('inventory_urls.json', 'r') as f:
+    with open('intersight_urls.json', 'r') as f:
         json_data = json.load(f)
 
-    for k,v in json_data.items():
-        base_path = "https://intersight.com/api/v1/"
-        endpoint_path = v['path']
-        query_parameters = v['query_parameters']
+    if args.resume and args.render_only:
+        parser.error("--resume fetches the missing sheets, it cannot be used with --render-only")
+    try:
+        only = get_sheet_names(args.only, json_data)
+        exclude = get_sheet_names(args.exclude, json_data)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Selected sheets are replaced in the existing workbook, the others are kept
+    # Derived sheets need their sources fetched, not when rendering from data files
+    update = bool(only or exclude)
+    if update:
+        json_data = select_sheets(json_data, only, exclude, dependencies=not args.render_only)
+        if not json_data:
+            parser.error("no sheet selected")
+    if args.output:
+        if args.fetch_only:
+            parser.error("--output names a workbook, --fetch-only does not write one")
+        if targets_file and os.getenv("TargetOutput", "merged").lower() == "separate":
+            parser.error("--output writes one workbook, it cannot be used with TargetOutput=separate")
+        # A new workbook with just the selected sheets, the existing one is left as it is
+        update = False
 
-        api_count_url = f"{base_path}{endpoint_path}?$count=True"
-        if query_parameters != "":
-            api_url = f"{base_path}{endpoint_path}?{query_parameters}"
+    if not targets_file:
+        if args.render_only:
+            render_report(json_data, update=update, file_name=args.output)
+            sys.exit(0)
+        apply_settings()
+        try:
+            build_report(json_data, client_id, client_secret, os.getenv("BaseUrl", BASE_URL),
+                         workbook=not args.fetch_only, resume=args.resume, update=update, file_name=args.output)
+        except (Exception, SystemExit):
+            if checkpointed:
+                print("-> Run failed, finished sheets are kept in ./Data/checkpoint. "
+                      "Run again with --resume to continue", file=sys.stderr)
+            raise
+    else:
+        # Multi-target mode: one worker process per account or appliance
+        targets = load_targets(targets_file)
+        target_workers = int(os.getenv("TargetWorkers", TARGET_WORKERS))
+        # merged: one workbook with a Tenant column, separate: ./Data/<name>/Inventory.xlsx per target
+        merged = os.getenv("TargetOutput", "merged").lower() != "separate"
+
+        results = {}
+        if args.render_only:
+            # Data files of the earlier runs, per target
+            for target in targets:
+                data_dir = f"./Data/{target['name']}"
+                if not merged:
+                    results[target["name"]] = render_report(json_data, data_dir=data_dir, update=update)
+                    continue
+                sheet_files = {k: find_data_file(data_dir, k) for k in json_data}
+                results[target["name"]] = {k: v for k,v in sheet_files.items() if v is not None}
         else:
-            api_url = f"{base_path}{endpoint_path}"
-  
-
-        # Intersight API Nested Data        
-        data = get_data(client_id, client_secret, token, api_count_url, api_url)
-        
-        if data:
-            # Flattened Data
-            semi_parsed_data = parse_data(data)
-
-            # Remove Parameters from Parsed Data before Writing
-            parsed_data = remove_parameters(semi_parsed_data)
-
-            # Write Flattened Data to a JSON file
-            data_file = f"./Data/{k}.json"
-
-            if k == "Empty_Chassis_Slots":
-                data = find_empty_slots(parsed_data)
-                parsed_data = data
-
-            if k == "licenses":
-                data = get_licenses(parsed_data)
-                parsed_data = data
-            
-            if k == "sp_policies":
-                # pprint(parsed_data)
-                data = get_sp_policies(parsed_data)
-                parsed_data = data
-
-            if k == "vnics":
-                vnic_data = get_vnic_ethifs(client_id, client_secret, token, parsed_data)
-                parsed_data = vnic_data
-
-            if k == "vhbas":
-                vhba_data = get_vhba_fcifs(client_id, client_secret, token, parsed_data)
-                parsed_data = vhba_data
-
-            # Create Data json file
-            with open(data_file, 'w') as f:
-                f.write(json.dumps(parsed_data))
-
-            # Create Excel File
-            file_name = "./Data/Inventory.xlsx"   # Update
-            sheet_name = k           # Update
-        
-            print(f"Creating Sheet: {k}")
-            header_list = []
-            for d in parsed_data:
-                for k in d.keys():
-                    if k not in header_list:
-                        header_list.append(k)
-
-            # header_list = list(parsed_data[0].keys())
-
-            # for k,v in enumerate(json_data):
-            #     row_data = list(v.values())
-
-            # Write to Elsx file
-            write_to_excel(file_name, sheet_name, header_list, parsed_data)
-
-            # Autofit Columns in sheet
-            auto_size_columns(file_name, sheet_name)
-
-    # Create Hyperlinks Sheet
-    file_name = "./Data/Inventory.xlsx"
-    print(f"Creating Sheet: Hyperlinks")
-    create_hyperlinks_sheet(file_name)
+            # A fresh process per target, so no token or rate state carries over
+            workbook = not merged and not args.fetch_only
+            with ProcessPoolExecutor(max_workers=target_workers, max_tasks_per_child=1) as executor:
+                futures = {target["name"]: executor.submit(crawl_target, json_data, target, workbook, args.resume,
+                                                           update)
+                           for target in targets}
+                for name, future in futures.items():
+                    try:
+                        results[name] = future.result()
+                        print(f"-> {name}: done")
+                    except (Exception, SystemExit) as e:
+                        print(f"-> {name}: failed: {e!r}", file=sys.stderr)
+
+            if checkpointed and len(results) < len(targets):
+                print("-> Failed targets keep their finished sheets in ./Data/<name>/checkpoint. "
+                      "Run again with --resume to continue", file=sys.stderr)
 
-    # Set Hyperlinks as Default Sheet
-    sheet_name = "Hyperlinks"
-    set_default_sheet(file_name, sheet_name)
+        if merged and results and not args.fetch_only:
+            summary_only = os.getenv("SummaryOnly", "").lower() in ["1", "true", "yes"]
+            merge_workbook(json_data, results,
+                           file_name=args.output or ("./Data/Summary.xlsx" if summary_only else "./Data/Inventory.xlsx"),
+                           streaming=os.getenv("Streaming", "").lower() in ["1", "true", "yes"],
+                           run_stats_sheet=(os.getenv("RunStatsSheet", "").lower() in ["1", "true", "yes"] and
+                                            not args.render_only),
+                           update=update)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+    Incremental decoding of Intersight list responses
+    The Results array of a page is decoded one object at a time as the body
+    is read from the connection, so a page is never held as its full text
+    and its full object tree at once
+    orjson is used for whole bodies when it is installed: pip install orjson
+"""
+import re
+import json
+import codecs
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Bytes read per step from the response body
+CHUNK_SIZE = 65536
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Characters that can continue a number, e.g. "1" may be followed by ".25" in the next piece
+NUMBER_CHARS = frozenset("0123456789.eE+-")
+decoder = json.JSONDecoder()
+
+
+def loads(data):
+    """
+        Decode a whole JSON body, bytes or text, with the fastest installed backend
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def iter_text(chunks):
+    """
+        Yield UTF-8 byte chunks as text, a character split across chunks is kept for the next one
+    """
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        yield text_decoder.decode(chunk)
+    yield text_decoder.decode(b"", final=True)
+
+
+class ResultsDecoder:
+    """
+        Push decoder for a {"ObjectType": ..., "Count": ..., "Results": [...]} body
+        feed() takes the next piece of text and returns the Results objects it
+        completed. The other top-level members are kept in fields
+    """
+    def __init__(self, key="Results"):
+        self.key = key
+        self.fields = {}
+        self.buffer = ""
+        self.state = "start"
+        self.current_key = None
+        # An incomplete value is retried once the buffer has doubled, not on every piece
+        self.retry_at = 0
+
+    def feed(self, text):
+        self.buffer += text
+        if len(self.buffer) < self.retry_at:
+            return []
+        objects = []
+        pos = self.parse(objects)
+        self.buffer = self.buffer[pos:]
+        return objects
+
+    def close(self):
+        """
+            Decode what is left of the buffer, return its objects and check that
+            the whole body was decoded
+        """
+        objects = []
+        self.buffer = self.buffer[self.parse(objects):]
+        if self.state != "end" or self.buffer.strip():
+            raise ValueError(f"incomplete JSON body, {len(self.buffer)} characters left")
+        return objects
+
+    def decode(self, buffer, pos):
+        """
+            Return (value, end position), or None when the value may continue in the next piece
+        """
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            return None
+        # A number is complete once a character that cannot continue it follows,
+        # "1." or "1e" at the end of the buffer decode as 1 but may be 1.25 or 1e3
+        if type(value) in (int, float) and (end == len(buffer) or buffer[end] in NUMBER_CHARS):
+            return None
+        return value, end
+
+    def parse(self, objects):
+        """
+            Consume as much of the buffer as possible, return the position reached
+        """
+        buffer = self.buffer
+        end = len(buffer)
+        pos = 0
+        self.retry_at = 0
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()
+            if pos == end:
+                return pos
+            char = buffer[pos]
+            if self.state == "start":
+                if char != "{":
+                    raise ValueError(f"expected a JSON object, got {char!r}")
+                self.state = "key"
+                pos += 1
+            elif self.state == "key":
+                if char == ",":
+                    pos += 1
+                    continue
+                if char == "}":
+                    self.state = "end"
+                    pos += 1
+                    continue
+                decoded = self.decode(buffer, pos)
+                if decoded is None:
+                    break
+                key, key_end = decoded
+                colon = WHITESPACE.match(buffer, key_end).end()
+                if colon == end:
+                    break
+                if buffer[colon] != ":":
+                    raise ValueError(f"expected ':' after {key!r}")
+                self.current_key = key
+                self.state = "results" if key == self.key else "value"
+                pos = colon + 1
+            elif self.state == "value":
+                decoded = self.decode(buffer, pos)
+                if decoded is None:
+                    break
+                self.fields[self.current_key], pos = decoded
+                self.state = "key"
+            elif self.state == "results":
+                if char != "[":
+                    raise ValueError(f"expected {self.key} to be a list")
+                self.state = "item"
+                pos += 1
+            elif self.state == "item":
+                if char == ",":
+                    pos += 1
+                    continue
+                if char == "]":
+                    self.state = "key"
+                    pos += 1
+                    continue
+                decoded = self.decode(buffer, pos)
+                if decoded is None:
+                    break
+                item, pos = decoded
+                objects.append(item)
+            else:
+                raise ValueError("unexpected data after the JSON body")
+        self.retry_at = 2 * (end - pos)
+        return pos
+
+
+def iter_results(chunks, fields=None, key="Results"):
+    """
+        Yield the objects of the Results list of a JSON body read as byte
+        chunks, e.g. response.iter_content(CHUNK_SIZE)
+        The other top-level members (Count, ObjectType) are stored in fields
+        With orjson the body is joined and decoded whole, it is faster than the incremental decoder
+    """
+    if orjson is not None:
+        response = orjson.loads(b"".join(chunks))
+        if fields is not None:
+            fields.update((k, v) for k, v in response.items() if k != key)
+        yield from response.get(key, [])
+        return
+    results_decoder = ResultsDecoder(key)
+    for text in iter_text(chunks):
+        yield from results_decoder.feed(text)
+    yield from results_decoder.close()
+    if fields is not None:
+        fields.update(results_decoder.fields)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+    Per-endpoint run metrics
+    Request, page, retry, 401/429 and byte counters recorded by get_api_data,
+    time spent in each phase of the report, an opt-in cProfile of the whole
+    run and tracemalloc dump per endpoint
+"""
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Counters and phases, in Run_Stats column order
+COUNTERS = ["requests", "pages", "retries", "401", "429", "bytes"]
+PHASES = ["fetch", "flatten", "transform", "json", "write"]
+
+
+class RunMetrics:
+    """
+        Thread-safe metrics for one report run
+        API calls are attributed to an endpoint by the longest registered URL prefix
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prefixes = {}
+        self.endpoints = {}
+        self.profile_dir = None
+        self.profilers = []
+        self.started = time.time()
+
+    def enable_profiling(self, profile_dir):
+        """
+            Start one cProfile for the whole process and the per-endpoint
+            tracemalloc dumps into profile_dir
+            From Python 3.12 a profiler sees every thread and only one can be
+            active. Before 3.12 it only sees the thread that enabled it, so each
+            thread started afterwards (endpoint and page workers) gets its own
+            and they are merged by finish_profiling
+        """
+        os.makedirs(profile_dir, exist_ok=True)
+        self.profile_dir = profile_dir
+        tracemalloc.start()
+        if sys.version_info < (3, 12):
+            threading.setprofile(self.start_thread_profiler)
+        self.start_thread_profiler()
+
+    def start_thread_profiler(self, *args):
+        """
+            Enable a profiler in the calling thread, also the threading.setprofile
+            hook, replaced by the profiler on its first call
+        """
+        profiler = cProfile.Profile()
+        with self.lock:
+            self.profilers.append(profiler)
+        profiler.enable()
+
+    def finish_profiling(self):
+        """
+            Stop the profilers and write <profile_dir>/run.prof
+        """
+        if not self.profile_dir:
+            return
+        threading.setprofile(None)
+        with self.lock:
+            profilers, self.profilers = self.profilers, []
+        for profiler in profilers:
+            profiler.disable()
+        stats = pstats.Stats(*profilers)
+        stats.dump_stats(os.path.join(self.profile_dir, "run.prof"))
+
+    def register(self, sheet_name, url_prefix):
+        """
+            Attribute every API call starting with url_prefix to the sheet
+        """
+        self.prefixes[url_prefix] = sheet_name
+        self.get_endpoint(sheet_name)
+
+    def get_endpoint(self, sheet_name):
+        """
+            Return the metrics dict of a sheet, created on first use
+        """
+        with self.lock:
+            if sheet_name not in self.endpoints:
+                endpoint = {counter: 0 for counter in COUNTERS}
+                endpoint.update({phase: 0.0 for phase in PHASES})
+                self.endpoints[sheet_name] = endpoint
+            return self.endpoints[sheet_name]
+
+    def find_endpoint(self, api_url):
+        """
+            Return the sheet an API URL belongs to, "Other" if none matches
+        """
+        sheet_name = "Other"
+        match_len = 0
+        for url_prefix, prefix_sheet in self.prefixes.items():
+            if api_url.startswith(url_prefix) and len(url_prefix) > match_len:
+                sheet_name = prefix_sheet
+                match_len = len(url_prefix)
+        return sheet_name
+
+    def add(self, sheet_name, counter, value=1):
+        endpoint = self.get_endpoint(sheet_name)
+        with self.lock:
+            endpoint[counter] += value
+
+    def record_response(self, api_url, status_code, num_bytes, retried):
+        """
+            Record one HTTP response of get_api_data
+        """
+        sheet_name = self.find_endpoint(api_url)
+        self.add(sheet_name, "requests")
+        self.add(sheet_name, "bytes", num_bytes)
+        if status_code == 200:
+            self.add(sheet_name, "pages")
+        if status_code in [401, 429]:
+            self.add(sheet_name, str(status_code))
+        if retried:
+            self.add(sheet_name, "retries")
+
+    def record_bytes(self, api_url, num_bytes):
+        """
+            Record the body of a streamed response, read after record_response
+        """
+        self.add(self.find_endpoint(api_url), "bytes", num_bytes)
+
+    @contextmanager
+    def phase(self, sheet_name, phase):
+        """
+            Time a phase of a sheet, e.g. with run_metrics.phase("FI", "fetch"):
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(sheet_name, phase, time.perf_counter() - start)
+
+    @contextmanager
+    def profile(self, sheet_name):
+        """
+            Track traced memory while processing a sheet, writes <profile_dir>/<sheet_name>.mem.txt
+            tracemalloc is process wide: with EndpointWorkers > 1 the peak also
+            counts the sheets fetched at the same time, and each sheet resets it
+            Run with EndpointWorkers=1 for per-endpoint peaks
+        """
+        if not self.profile_dir:
+            yield
+            return
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            top_stats = tracemalloc.take_snapshot().statistics("lineno")[:25]
+            with open(os.path.join(self.profile_dir, f"{sheet_name}.mem.txt"), 'w') as f:
+                f.write(f"current={current} peak={peak}\n")
+                for stat in top_stats:
+                    f.write(f"{stat}\n")
+
+    def get_rows(self):
+        """
+            Return one row per endpoint plus a Total row, for the Run_Stats sheet
+        """
+        rows = []
+        total = {counter: 0 for counter in COUNTERS}
+        total.update({phase: 0.0 for phase in PHASES})
+        with self.lock:
+            for sheet_name, endpoint in self.endpoints.items():
+                row = {"Sheet": sheet_name}
+                for key, value in endpoint.items():
+                    row[key] = round(value, 3) if key in PHASES else value
+                    total[key] += value
+                rows.append(row)
+        total_row = {"Sheet": "Total"}
+        for key, value in total.items():
+            total_row[key] = round(value, 3) if key in PHASES else value
+        total_row["elapsed"] = round(time.time() - self.started, 3)
+        rows.append(total_row)
+        return rows
+
+    def save(self, file_name):
+        """
+            Write the run summary as JSON
+        """
+        with open(file_name, 'w') as f:
+            f.write(json.dumps({"started": self.started, "endpoints": self.get_rows()}, indent=4))
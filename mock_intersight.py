@@ -0,0 +1,879 @@
+#!/usr/bin/env python3
+"""
+    Local mock of the Intersight API for benchmarks
+    Serves /iam/token and the /api/v1 collections read by generate_report.py
+    from a synthetic fleet. Objects are generated on demand from their index,
+    so a 50k server fleet does not have to fit in memory
+    Supports $count, $inlinecount, $top/$skip, $orderby=Moid, $select, $expand,
+    the $filter forms used by this tool (eq, ne, gt, lt, ge, le joined by "and")
+    and $apply=groupby((...),aggregate(...))
+    Latency and 429 responses can be injected, responses are gzipped on request
+
+    Usage: ./mock_intersight.py --servers 1000 --port 8765 --latency 0.05 --throttle 0.01
+"""
+import re
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from projection import split_top_level
+
+# Per server fan-out, typical of a B/C-series server
+FANOUT = {
+    "dimms": 24,
+    "memory_arrays": 2,
+    "cpus": 2,
+    "disks": 4,
+    "virtual_drives": 2,
+    "controllers": 1,
+    "adapters": 2,
+    "pci_nodes": 2,
+    "pci_devices": 6,
+    "vnics": 4,
+    "vhbas": 2,
+}
+# Share of the fleet that are blades, the rest are rack servers
+BLADE_RATIO = 0.8
+# Blades per chassis, slot 8 is left empty; chassis per UCS domain (FI pair)
+BLADES_PER_CHASSIS = 7
+CHASSIS_PER_DOMAIN = 20
+# Page size when $top is not given, and the largest $top accepted
+DEFAULT_TOP = 100
+MAX_TOP = 1000
+# Creation and modification time of every object
+MOD_TIME = "2024-01-01T00:00:00.000Z"
+# Policies shared by all profiles, per policy type
+POLICIES = 4
+
+
+def moref(fleet, path, index):
+    """
+        Return a relationship to the object at index of a collection
+    """
+    table = fleet.tables[path]
+    return {
+        "ClassId": "mo.MoRef",
+        "Moid": table.get_moid(index),
+        "ObjectType": table.class_id,
+        "link": f"{fleet.base_url}/api/v1/{path}/{table.get_moid(index)}",
+    }
+
+
+class Table:
+    """
+        One API collection, objects built on demand by build(fleet, index)
+        Moids are the table id followed by the index, so they sort by index
+    """
+    def __init__(self, table_id, path, class_id, count, build):
+        self.table_id = table_id
+        self.path = path
+        self.class_id = class_id
+        self.count = count
+        self.build = build
+
+    def get_moid(self, index):
+        return f"{self.table_id:04x}{index:020x}"
+
+    def get_index(self, moid):
+        return int(moid[4:], 16)
+
+
+class Fleet:
+    """
+        Synthetic fleet of blades and rack servers, with chassis, FIs, inventory
+        children, server profiles, policies, vNICs and vHBAs
+    """
+    def __init__(self, servers, fanout=None, base_url="http://127.0.0.1:8765"):
+        self.servers = servers
+        self.fanout = dict(FANOUT)
+        self.fanout.update(fanout or {})
+        self.base_url = base_url
+        self.blades = int(servers * BLADE_RATIO)
+        self.racks = servers - self.blades
+        self.chassis = -(-self.blades // BLADES_PER_CHASSIS)
+        self.domains = max(1, -(-self.chassis // CHASSIS_PER_DOMAIN))
+        self.fis = self.domains * 2
+        self.tables = {}
+        self.by_id = {}
+        f = self.fanout
+        for path, class_id, count, build in [
+            ("network/ElementSummaries", "network.ElementSummary", self.fis, build_fi),
+            ("equipment/Chasses", "equipment.Chassis", self.chassis, build_chassis),
+            ("equipment/IoCards", "equipment.IoCard", self.chassis * 2, build_iocard),
+            ("equipment/ExpanderModules", "equipment.ExpanderModule", self.chassis * 2, build_expander),
+            ("compute/Boards", "compute.Board", servers, build_board),
+            ("compute/Blades", "compute.Blade", self.blades, build_blade),
+            ("compute/RackUnits", "compute.RackUnit", self.racks, build_rack),
+            ("equipment/Psus", "equipment.Psu", self.chassis * 6 + self.racks * 2, build_psu),
+            ("equipment/FanModules", "equipment.FanModule", self.chassis * 8 + self.racks * 7, build_fan_module),
+            ("equipment/Fans", "equipment.Fan", (self.chassis * 8 + self.racks * 7) * 2, build_fan),
+            ("processor/Units", "processor.Unit", servers * f["cpus"], build_cpu),
+            ("memory/Units", "memory.Unit", servers * f["dimms"], build_dimm),
+            ("memory/Arrays", "memory.Array", servers * f["memory_arrays"], build_memory_array),
+            ("adapter/Units", "adapter.Unit", servers * f["adapters"], build_adapter),
+            ("storage/Controllers", "storage.Controller", servers * f["controllers"], build_controller),
+            ("storage/PhysicalDisks", "storage.PhysicalDisk", servers * f["disks"], build_disk),
+            ("storage/VirtualDrives", "storage.VirtualDrive", servers * f["virtual_drives"], build_virtual_drive),
+            ("equipment/Tpms", "equipment.Tpm", servers, build_tpm),
+            ("pci/Nodes", "pci.Node", self.chassis * f["pci_nodes"], build_pci_node),
+            ("pci/Devices", "pci.Device", servers * f["pci_devices"], build_pci_device),
+            ("equipment/Transceivers", "equipment.Transceiver", self.fis * 32, build_transceiver),
+            ("storage/Items", "storage.Item", self.fis * 4, build_storage_item),
+            ("asset/DeviceRegistrations", "asset.DeviceRegistration", self.domains, build_registration),
+            ("asset/DeviceContractInformations", "asset.DeviceContractInformation", servers, build_contract),
+            ("server/Profiles", "server.Profile", servers, build_profile),
+            ("network/Vethernets", "network.Vethernet", servers * f["vnics"], build_vethernet),
+            ("network/Vfcs", "network.Vfc", servers * f["vhbas"], build_vfc),
+            ("vnic/EthIfs", "vnic.EthIf", servers * f["vnics"], build_ethif),
+            ("vnic/FcIfs", "vnic.FcIf", servers * f["vhbas"], build_fcif),
+            ("bios/Policies", "bios.Policy", POLICIES, build_policy),
+            ("boot/PrecisionPolicies", "boot.PrecisionPolicy", POLICIES, build_policy),
+            ("vnic/LanConnectivityPolicies", "vnic.LanConnectivityPolicy", POLICIES, build_policy),
+            ("vnic/SanConnectivityPolicies", "vnic.SanConnectivityPolicy", POLICIES, build_policy),
+            ("vnic/EthQosPolicies", "vnic.EthQosPolicy", POLICIES, build_eth_qos),
+            ("fabric/EthNetworkGroupPolicies", "fabric.EthNetworkGroupPolicy", POLICIES, build_network_group),
+            ("vnic/FcAdapterPolicies", "vnic.FcAdapterPolicy", POLICIES, build_fc_adapter),
+            ("vnic/FcNetworkPolicies", "vnic.FcNetworkPolicy", POLICIES, build_fc_network),
+            ("vnic/FcQosPolicies", "vnic.FcQosPolicy", POLICIES, build_fc_qos),
+            ("fcpool/Pools", "fcpool.Pool", POLICIES, build_policy),
+            ("vnic/LcpEthIfs", "vnic.EthIf", POLICIES, build_lcp_vnic),
+            ("vnic/ScpFcIfs", "vnic.FcIf", POLICIES, build_scp_vhba),
+            ("compute/PhysicalSummaries", "compute.PhysicalSummary", servers, build_physical_summary),
+        ]:
+            table = Table(len(self.tables) + 1, path, class_id, count, build)
+            self.tables[path] = table
+            self.by_id[table.table_id] = table
+
+    def get(self, path, index):
+        """
+            Return the full object at index of a collection
+        """
+        table = self.tables[path]
+        item = {
+            "AccountMoid": "5d5d5d5d5d5d5d5d5d5d5d5d",
+            "Ancestors": [],
+            "ClassId": table.class_id,
+            "CreateTime": MOD_TIME,
+            "DomainGroupMoid": "5e5e5e5e5e5e5e5e5e5e5e5e",
+            "ModTime": MOD_TIME,
+            "Moid": table.get_moid(index),
+            "ObjectType": table.class_id,
+            "Owners": ["5d5d5d5d5d5d5d5d5d5d5d5d"],
+            "PermissionResources": [],
+            "SharedScope": "",
+            "Tags": [],
+        }
+        item.update(table.build(self, index))
+        return item
+
+    def resolve(self, moid):
+        """
+            Return the object a relationship points to
+        """
+        table = self.by_id.get(int(moid[:4], 16))
+        return self.get(table.path, table.get_index(moid))
+
+    def get_server(self, server):
+        """
+            Return (path, index) of a server: blades first, then rack units
+        """
+        if server < self.blades:
+            return "compute/Blades", server
+        return "compute/RackUnits", server - self.blades
+
+    def get_server_ref(self, server):
+        return moref(self, *self.get_server(server))
+
+    def get_serial(self, server):
+        return f"FCH{server:08d}"
+
+    def get_domain(self, server):
+        """
+            Return the UCS domain of a server, rack units are spread over the domains
+        """
+        if server < self.blades:
+            return server // BLADES_PER_CHASSIS // CHASSIS_PER_DOMAIN
+        return (server - self.blades) % self.domains
+
+    def get_fi_ref(self, server, side):
+        return moref(self, "network/ElementSummaries", self.get_domain(server) * 2 + side)
+
+    def get_slot_name(self, server):
+        """
+            Blade names follow <domain>-<chassis>-<slot>
+        """
+        chassis = server // BLADES_PER_CHASSIS
+        return f"ucs{self.get_domain(server)}-{chassis + 1}-{server % BLADES_PER_CHASSIS + 1}"
+
+
+def build_fi(fleet, i):
+    return {
+        "AdminEvacState": "disabled", "BundleVersion": "4.3(2b)", "FirmwareVersion": "9.3(5)I43(2b)",
+        "EthernetSwitchingMode": "end-host", "FcSwitchingMode": "end-host",
+        "OutOfBandIpAddress": f"10.0.{i // 250}.{i % 250 + 1}", "ManagementMode": "Intersight",
+        "Name": f"ucs{i // 2} FI-{'AB'[i % 2]}", "SwitchId": "AB"[i % 2], "Model": "UCS-FI-6454",
+        "Serial": f"FDO{i:08d}", "SwitchProfileName": f"ucs{i // 2}-{'AB'[i % 2]}",
+        "SwitchType": "FabricInterconnect", "NumEtherPorts": 54, "NumEtherPortsConfigured": 12,
+        "NumEtherPortsLinkUp": 10, "NumFcPorts": 8, "NumFcPortsConfigured": 4, "NumFcPortsLinkUp": 4,
+        "NumExpansionModules": 0, "OperEvacState": "", "Operability": "online",
+        "ReservedVlanStartId": 3915, "TotalMemory": 32768, "UserLabel": "",
+    }
+
+
+def build_chassis(fleet, i):
+    return {
+        "Name": f"ucs{i // CHASSIS_PER_DOMAIN}-{i + 1}", "Model": "UCSX-9508", "ChassisId": i + 1,
+        "Serial": f"FOX{i:08d}", "ManagementMode": "Intersight", "UserLabel": "",
+        "Tags": [{"Key": "site", "Value": f"dc{i % 3}"}], "ConnectionStatus": "A,B",
+        "OperState": "ok", "ProductName": "Cisco UCS X9508 Chassis",
+    }
+
+
+def build_iocard(fleet, i):
+    return {
+        "ConnectionPath": "A,B", "Description": "UCS 9108 25G IFM", "Dn": f"sys/chassis-{i // 2 + 1}/slot-{i % 2 + 1}",
+        "Parent": moref(fleet, "equipment/Chasses", i // 2), "Model": "UCSX-I-9108-25G", "ModuleId": i % 2 + 1,
+        "OperState": "ok", "Pid": "UCSX-I-9108-25G", "Presence": "equipped",
+        "ProductName": "UCS 9108 25G IFM", "Serial": f"FCH{i:08d}A", "Side": "left" if i % 2 == 0 else "right",
+        "Version": "4.3(2b)",
+    }
+
+
+def build_expander(fleet, i):
+    return {
+        "Parent": moref(fleet, "equipment/Chasses", i // 2), "Dn": f"sys/chassis-{i // 2 + 1}/xfm-{i % 2 + 1}",
+        "Model": "UCSX-F-9416", "ModuleId": i % 2 + 1, "OperState": "ok", "Presence": "equipped",
+        "Serial": f"FCH{i:08d}X",
+    }
+
+
+def build_board(fleet, i):
+    return {"Parent": fleet.get_server_ref(i), "Serial": fleet.get_serial(i), "Model": "UCSX-210C-M6"}
+
+
+def build_server(fleet, server):
+    """
+        Properties shared by blades and rack units
+    """
+    return {
+        "Board": moref(fleet, "compute/Boards", server), "AssetTag": "", "CpuCapacity": 92.8,
+        "AvailableMemory": 524288, "TotalMemory": 524288, "Firmware": "5.2(0.230041)",
+        "FrontPanelLockState": "Unlock", "MgmtIpAddress": f"10.1.{server // 250}.{server % 250 + 1}",
+        "NumCpus": 2, "NumCpuCores": 64, "NumCpuCoresEnabled": 64, "NumThreads": 128, "NumAdaptors": 2,
+        "NumEthHostInterfaces": 4, "NumFcHostInterfaces": 2, "OperPowerState": "on", "Personality": [],
+        "PlatformType": "IMCBlade", "Presence": "equipped", "Serial": fleet.get_serial(server),
+        "ServiceProfile": "", "TunneledKvm": False, "UserLabel": "", "Uuid": f"{server:08x}-0000-0000-0000-000000000000",
+        "Tags": [{"Key": "Intersight.LicenseTier", "Value": "Essential" if server % 5 == 0 else "Advantage"}],
+    }
+
+
+def build_blade(fleet, i):
+    item = build_server(fleet, i)
+    chassis = i // BLADES_PER_CHASSIS
+    item.update({
+        "Parent": moref(fleet, "equipment/Chasses", chassis), "Dn": f"/redfish/v1/Systems/{fleet.get_serial(i)}",
+        "Model": "UCSX-210C-M6", "Name": fleet.get_slot_name(i), "ServerId": 0,
+        "SlotId": i % BLADES_PER_CHASSIS + 1, "ChassisId": chassis + 1,
+    })
+    return item
+
+
+def build_rack(fleet, i):
+    server = fleet.blades + i
+    item = build_server(fleet, server)
+    item.update({"Model": "UCSC-C220-M6S", "Name": f"rack-{i + 1}", "PlatformType": "IMCRack",
+                 "ServerId": i + 1, "SlotId": 0})
+    return item
+
+
+def build_physical_summary(fleet, i):
+    """
+        Server summaries list blades first, then rack units, like get_server
+    """
+    path, index = fleet.get_server(i)
+    item = fleet.get(path, index)
+    return {k: item[k] for k in ["Model", "Name", "Serial", "Firmware", "PlatformType", "NumCpus",
+                                 "TotalMemory", "OperPowerState", "MgmtIpAddress"]}
+
+
+def get_parent(fleet, i, per_chassis, per_rack):
+    """
+        Return the parent of a PSU or fan module: chassis first, then rack units
+    """
+    chassis_count = fleet.chassis * per_chassis
+    if i < chassis_count:
+        return moref(fleet, "equipment/Chasses", i // per_chassis)
+    return fleet.get_server_ref(fleet.blades + (i - chassis_count) // per_rack)
+
+
+def build_psu(fleet, i):
+    return {
+        "Parent": get_parent(fleet, i, 6, 2), "Dn": f"sys/psu-{i}", "Model": "UCSX-PSU-2800AC", "Serial": f"ART{i:08d}",
+        "OperState": "ok", "PartNumber": "341-0732-02", "Presence": "equipped", "PsuId": i % 6 + 1, "Voltage": "ok",
+    }
+
+
+def build_fan_module(fleet, i):
+    return {"Parent": get_parent(fleet, i, 8, 7), "Dn": f"sys/fan-module-{i}", "OperState": "operable",
+            "Presence": "equipped", "ModuleId": i % 8 + 1}
+
+
+def build_fan(fleet, i):
+    return {
+        "Parent": moref(fleet, "equipment/FanModules", i // 2), "Dn": f"sys/fan-module-{i // 2}/fan-{i % 2 + 1}",
+        "FanId": i % 2 + 1, "FanModuleId": i // 2 % 8 + 1, "Model": "", "OperState": "operable", "Presence": "equipped",
+    }
+
+
+def build_cpu(fleet, i):
+    server = i // fleet.fanout["cpus"]
+    return {
+        "Parent": moref(fleet, "compute/Boards", server), "Architecture": "Xeon",
+        "Description": "Intel(R) Xeon(R) Gold 6338 CPU @ 2.00GHz", "Dn": f"sys/rack-unit-1/board/cpu-{i % 2 + 1}",
+        "Model": "Intel(R) Xeon(R) Gold 6338 CPU @ 2.00GHz", "NumCores": 32, "NumCoresEnabled": 32,
+        "NumThreads": 64, "OperState": "Enabled", "Pid": "UCSX-CPU-I6338", "Presence": "equipped",
+        "ProcessorId": i % 2 + 1, "Speed": 2.0,
+    }
+
+
+def build_dimm(fleet, i):
+    server = i // fleet.fanout["dimms"]
+    slot = i % fleet.fanout["dimms"]
+    return {
+        "Parent": moref(fleet, "memory/Arrays", server * fleet.fanout["memory_arrays"]),
+        "ArrayId": 1, "Bank": 0, "Capacity": "32768", "Clock": "3200", "Description": "DDR4 RDIMM",
+        "Dn": f"sys/rack-unit-1/board/memarray-1/mem-{slot + 1}", "FormFactor": "DIMM",
+        "Location": f"DIMM_{'ABCDEFGHIJKLMNOP'[slot % 16]}{slot // 16 + 1}", "MemoryId": slot + 1,
+        "Model": "M393A4K40EB3-CWE", "OperState": "Operable", "Pid": "UCSX-MR-X32G2RW",
+        "Presence": "equipped", "Serial": f"{i:08X}", "Type": "DDR4", "Vendor": "0xCE00", "Width": 64,
+    }
+
+
+def build_memory_array(fleet, i):
+    server = i // fleet.fanout["memory_arrays"]
+    return {
+        "Parent": moref(fleet, "compute/Boards", server), "Dn": f"sys/rack-unit-1/board/memarray-{i % 2 + 1}",
+        "CpuId": i % 2 + 1, "ArrayId": i % 2 + 1, "CurrentCapacity": 393216, "ErrorCorrection": "ECC",
+        "Presence": "equipped",
+    }
+
+
+def build_adapter(fleet, i):
+    server = i // fleet.fanout["adapters"]
+    return {
+        "Parent": moref(fleet, "compute/Boards", server), "AdapterId": f"UCSX-V4-Q25GML_{i}",
+        "Dn": f"sys/rack-unit-1/adaptor-{i % 2 + 1}", "Model": "UCSX-V4-Q25GML", "PciSlot": f"MLOM{i % 2}",
+        "Presence": "equipped", "Vendor": "Cisco Systems Inc",
+    }
+
+
+def build_controller(fleet, i):
+    server = i // fleet.fanout["controllers"]
+    return {
+        "Parent": moref(fleet, "compute/Boards", server), "ControllerId": "MRAID", "Dn": "sys/rack-unit-1/board/storage-SAS-MRAID",
+        "Model": "UCSX-X10C-RAIDF", "PciAddr": "22:00.0", "Presence": "equipped", "RaidSupport": "yes",
+        "Serial": f"SK{i:08d}", "Type": "SAS", "Vendor": "Broadcom / LSI",
+    }
+
+
+def build_disk(fleet, i):
+    server = i // fleet.fanout["disks"]
+    return {
+        "Parent": moref(fleet, "storage/Controllers", server * fleet.fanout["controllers"]),
+        "BlockSize": "512", "Bootable": "false", "Description": "960GB 2.5 inch Enterprise Value 6G SATA SSD",
+        "DiskId": i % fleet.fanout["disks"] + 1, "DiskState": "good", "Dn": f"sys/rack-unit-1/board/storage-SAS-MRAID/disk-{i % 4 + 1}",
+        "DriveFirmware": "D3MC000", "EncryptionStatus": "Not Capable", "FailurePredicted": False, "LinkSpeed": "6.0 Gb/s",
+        "MediaErrorCount": 0, "Model": "MTFDDAK960TDS", "Pid": "UCS-SD960GK1X-EV", "Operability": "Online",
+        "PartNumber": "", "PercentLifeLeft": 99, "PhysicalBlockSize": "4096", "Presence": "equipped",
+        "Protocol": "SATA", "Serial": f"MSA{i:08d}", "Size": "915715", "Type": "SSD", "Vendor": "MICRON",
+    }
+
+
+def build_virtual_drive(fleet, i):
+    server = i // fleet.fanout["virtual_drives"]
+    return {
+        "AccessPolicy": "Read-Write", "ActualWriteCachePolicy": "Write Through", "AvailableSize": "0",
+        "BlockSize": "512", "Bootable": "true", "ConfigState": "Applied", "ConfiguredWriteCachePolicy": "Write Through",
+        "Dn": f"sys/rack-unit-1/board/storage-SAS-MRAID/vd-{i % 2}", "DriveCache": "Disable",
+        "DriveSecurity": "Disabled", "DriveState": "Optimal", "IoPolicy": "Direct", "Name": f"vd{i % 2}",
+        "Operability": "Optimal", "Parent": moref(fleet, "storage/Controllers", server * fleet.fanout["controllers"]),
+        "Presence": "equipped", "ReadPolicy": "No Read Ahead", "Size": "914573", "StorageVirtualDriveContainer": None,
+        "StripSize": "64KiB", "Type": "RAID1", "Uuid": f"{i:032x}", "VendorUuid": f"{i:032x}", "VirtualDriveId": str(i % 2),
+    }
+
+
+def build_tpm(fleet, i):
+    return {
+        "Parent": moref(fleet, "compute/Boards", i), "Dn": "sys/rack-unit-1/board/Tpm", "Model": "UCSX-TPM-002C",
+        "Presence": "equipped", "Serial": f"TPM{i:08d}", "TpmId": 1, "Version": "2.0",
+    }
+
+
+def build_pci_node(fleet, i):
+    return {
+        "Parent": moref(fleet, "equipment/Chasses", i // fleet.fanout["pci_nodes"]), "Dn": f"sys/chassis-1/pci-node-{i % 2 + 1}",
+        "Model": "UCSX-440P", "NodeId": i % 2 + 1, "Presence": "equipped", "Serial": f"PCN{i:08d}",
+        "SlotId": str(i % 2 + 1), "Vendor": "Cisco Systems Inc",
+    }
+
+
+def build_pci_device(fleet, i):
+    server = i // fleet.fanout["pci_devices"]
+    return {
+        "Dn": f"sys/rack-unit-1/equipped-slot-{i % 6 + 1}", "FirmwareVersion": "5.2(3c)", "Model": "Cisco VIC 15428",
+        "Parent": moref(fleet, "compute/Boards", server), "Rn": f"equipped-slot-{i % 6 + 1}",
+        "Serial": f"PCD{i:08d}", "SlotId": str(i % 6 + 1), "Vendor": "Cisco Systems Inc",
+    }
+
+
+def build_transceiver(fleet, i):
+    fi = i // 32
+    return {
+        "Name": f"Ethernet1/{i % 32 + 1}", "Type": "sfp", "Serial": f"AVF{i:08d}", "SwitchId": "AB"[fi % 2],
+        "Dn": f"sys/switch-{'AB'[fi % 2]}/slot-1/switch-ether/port-{i % 32 + 1}/transceiver", "Model": "SFP-25G-AOC2M",
+        "OperSpeed": "25G", "OperStateQual": "", "Parent": moref(fleet, "network/ElementSummaries", fi),
+        "SlotId": 1, "PortId": i % 32 + 1, "OperState": "up", "Presence": "available", "Status": "ok",
+        "InterfaceType": "ethernet", "Vendor": "CISCO-AVAGO",
+    }
+
+
+def build_storage_item(fleet, i):
+    return {
+        "NetworkElement": moref(fleet, "network/ElementSummaries", i // 4),
+        "RegisteredDevice": moref(fleet, "asset/DeviceRegistrations", i // 8),
+        "Name": ["bootflash", "opt", "spare", "var_sysmgr"][i % 4], "Size": "100000", "Used": str(1000 * (i % 4 + 1)),
+    }
+
+
+def build_registration(fleet, i):
+    return {"DeviceHostname": [f"ucs{i} FI-A", f"ucs{i} FI-B"], "PlatformType": "UCSFIISM", "ConnectionStatus": "Connected"}
+
+
+def build_contract(fleet, i):
+    return {
+        "Contract": {"ClassId": "asset.Contract", "ObjectType": "asset.Contract", "ContractNumber": f"{9000000 + i % 50}",
+                     "BillTo": {"ClassId": "asset.AddressInformation", "ObjectType": "asset.AddressInformation",
+                                "Address1": "170 West Tasman Dr", "City": "San Jose", "Country": "US", "Name": "Acme"}},
+        "ContractStatus": "Active", "ContractStatusReason": "", "ServiceDescription": "SNTC-24X7X4",
+        "ServiceLevel": "SNTC", "ServiceStartDate": "2023-01-01T00:00:00Z", "ServiceEndDate": "2026-01-01T00:00:00Z",
+        "SalesOrderNumber": f"{100000 + i}", "PurchaseOrderNumber": f"PO{i}", "PlatformType": "IMCBlade",
+        "DeviceType": "Server", "DeviceId": fleet.get_serial(i), "Source": fleet.get_server_ref(i),
+    }
+
+
+def build_profile(fleet, i):
+    policies = ["bios/Policies", "boot/PrecisionPolicies", "vnic/LanConnectivityPolicies", "vnic/SanConnectivityPolicies"]
+    return {
+        "Name": f"sp-{i + 1}", "TargetPlatform": "FIAttached",
+        # Every tenth profile is unassociated
+        "AssociatedServer": None if i % 10 == 9 else fleet.get_server_ref(i),
+        "PolicyBucket": [moref(fleet, path, i % POLICIES) for path in policies],
+    }
+
+
+def build_vethernet(fleet, i):
+    server = i // fleet.fanout["vnics"]
+    vnic = i % fleet.fanout["vnics"]
+    return {
+        "VethId": 800 + i, "Description": f"Virtual ethernet for eth{vnic}, server:{fleet.get_serial(server)}",
+        "BoundInterfaceDn": f"sys/chassis-1/slot-1/host/port-{vnic + 1}", "NetworkElement": fleet.get_fi_ref(server, vnic % 2),
+        "OperState": "up", "OperReason": "none", "PinnedInterfaceDn": f"sys/switch-A/slot-1/switch-ether/port-{vnic + 49}",
+    }
+
+
+def build_vfc(fleet, i):
+    server = i // fleet.fanout["vhbas"]
+    vhba = i % fleet.fanout["vhbas"]
+    return {
+        "VfcId": 900 + i, "Description": f"Virtual fc for fc{vhba}, server:{fleet.get_serial(server)}",
+        "BoundInterfaceDn": f"sys/chassis-1/slot-1/host/port-{vhba + 5}", "NetworkElement": fleet.get_fi_ref(server, vhba % 2),
+        "OperState": "up", "OperReason": "none", "PinnedInterfaceDn": f"sys/switch-A/slot-1/switch-fc/port-{vhba + 1}",
+    }
+
+
+def build_placement(fleet, i):
+    return {"ClassId": "vnic.PlacementSettings", "ObjectType": "vnic.PlacementSettings", "AutoPciLink": False,
+            "AutoSlotId": False, "Id": "MLOM", "PciLink": 0, "PciLinkAssignmentMode": "Custom",
+            "SwitchId": "AB"[i % 2], "Uplink": 0}
+
+
+def build_ethif(fleet, i):
+    server = i // fleet.fanout["vnics"]
+    vnic = i % fleet.fanout["vnics"]
+    return {
+        "Name": f"eth{vnic}", "MacAddress": f"00:25:B5:{i >> 16 & 255:02X}:{i >> 8 & 255:02X}:{i & 255:02X}",
+        "FailoverEnabled": False, "VifId": 800 + i, "StandbyVifId": 0, "Placement": build_placement(fleet, vnic),
+        "Profile": moref(fleet, "server/Profiles", server), "EthQosPolicy": moref(fleet, "vnic/EthQosPolicies", vnic % POLICIES),
+        "FabricEthNetworkGroupPolicy": [moref(fleet, "fabric/EthNetworkGroupPolicies", vnic % POLICIES)],
+        "LcpVnic": moref(fleet, "vnic/LcpEthIfs", server % POLICIES),
+    }
+
+
+def build_fcif(fleet, i):
+    server = i // fleet.fanout["vhbas"]
+    vhba = i % fleet.fanout["vhbas"]
+    return {
+        "Name": f"fc{vhba}", "Order": vhba + 4, "Placement": build_placement(fleet, vhba),
+        "FcAdapterPolicy": moref(fleet, "vnic/FcAdapterPolicies", vhba % POLICIES),
+        "FcNetworkPolicy": moref(fleet, "vnic/FcNetworkPolicies", vhba % POLICIES),
+        "FcQosPolicy": moref(fleet, "vnic/FcQosPolicies", vhba % POLICIES),
+        "Profile": moref(fleet, "server/Profiles", server), "ScpVhba": moref(fleet, "vnic/ScpFcIfs", server % POLICIES),
+        "Type": "fc-initiator", "VifId": 900 + i, "Wwpn": f"20:00:00:25:B5:{i >> 8 & 255:02X}:{i & 255:02X}:{vhba:02X}",
+        "WwpnAddressType": "POOL", "WwpnPool": moref(fleet, "fcpool/Pools", vhba % POLICIES),
+    }
+
+
+def build_policy(fleet, i):
+    return {"Name": f"policy-{i + 1}", "Description": ""}
+
+
+def build_eth_qos(fleet, i):
+    return {"Name": f"qos-{i + 1}", "Mtu": 9000 if i % 2 else 1500, "Cos": i, "Priority": "Best Effort"}
+
+
+def build_network_group(fleet, i):
+    return {"Name": f"vlans-{i + 1}", "VlanSettings": {"ClassId": "fabric.VlanSettings", "ObjectType": "fabric.VlanSettings",
+                                                       "AllowedVlans": f"{100 * (i + 1)}-{100 * (i + 1) + 49}",
+                                                       "NativeVlan": 1, "QinqEnabled": False, "QinqVlan": 2}}
+
+
+def build_fc_adapter(fleet, i):
+    return {"Name": f"fc-adapter-{i + 1}", "IoThrottleCount": 256, "LunCount": 1024, "LunQueueDepth": 20}
+
+
+def build_fc_network(fleet, i):
+    return {"Name": f"fc-network-{i + 1}", "VsanSettings": {"ClassId": "vnic.VsanSettings", "ObjectType": "vnic.VsanSettings",
+                                                           "DefaultVlanId": 0, "Id": 100 + i}}
+
+
+def build_fc_qos(fleet, i):
+    return {"Name": f"fc-qos-{i + 1}", "Burst": 10240, "Cos": 3, "Priority": "Best Effort", "RateLimit": 0}
+
+
+def build_lcp_vnic(fleet, i):
+    return {"Name": f"eth{i}", "LanConnectivityPolicy": moref(fleet, "vnic/LanConnectivityPolicies", i)}
+
+
+def build_scp_vhba(fleet, i):
+    return {"Name": f"fc{i}", "SanConnectivityPolicy": moref(fleet, "vnic/SanConnectivityPolicies", i)}
+
+
+def parse_options(options):
+    """
+        Parse $select/$expand into (selected properties or None for all, {expand: (select, expands)})
+        Nested options are separated by ";" (sent as %3B)
+    """
+    select = None
+    expands = {}
+    for option in split_top_level(options, ["&", ";"]):
+        if option.startswith("$select="):
+            select = [p for p in option[len("$select="):].split(",") if p]
+        elif option.startswith("$expand="):
+            for item in split_top_level(option[len("$expand="):], [","]):
+                name, _, sub_options = item.partition("(")
+                expands[name] = parse_options(sub_options[:-1])
+    return select, expands
+
+
+def project(fleet, item, select, expands):
+    """
+        Apply $select/$expand to an object, relationships are resolved recursively
+    """
+    if select is not None:
+        keys = ["ClassId", "Moid", "ObjectType"] + [k for k in select if k not in ["ClassId", "Moid", "ObjectType"]]
+        item = {k: item[k] for k in keys if k in item}
+    for name, (sub_select, sub_expands) in expands.items():
+        value = item.get(name)
+        if isinstance(value, dict) and value.get("ClassId") == "mo.MoRef":
+            item[name] = project(fleet, fleet.resolve(value["Moid"]), sub_select, sub_expands)
+        elif isinstance(value, list):
+            item[name] = [project(fleet, fleet.resolve(v["Moid"]), sub_select, sub_expands)
+                          if isinstance(v, dict) and v.get("ClassId") == "mo.MoRef" else v for v in value]
+    return item
+
+
+def parse_filter(text):
+    """
+        Parse a $filter into a list of (property, operator, value)
+        Only conditions joined by "and" are supported
+    """
+    conditions = []
+    for condition in re.split(r"\s+and\s+", text.strip()):
+        condition = condition.strip().strip("()").strip()
+        match = re.match(r"^(\S+)\s+(eq|ne|gt|lt|ge|le)\s+(.+)$", condition)
+        if not match:
+            raise ValueError(f"unsupported $filter: {condition}")
+        prop, operator, value = match.groups()
+        value = value.strip()
+        if value.startswith("'") and value.endswith("'"):
+            value = value[1:-1]
+        conditions.append((prop, operator, None if value == "null" else value))
+    return conditions
+
+
+def match_filter(item, conditions):
+    for prop, operator, value in conditions:
+        actual = item.get(prop)
+        if isinstance(actual, dict):
+            actual = actual.get("Moid", "")
+        elif actual is not None:
+            actual = str(actual)
+        if operator == "eq" and actual != value:
+            return False
+        if operator == "ne" and actual == value:
+            return False
+        if operator in ["gt", "lt", "ge", "le"]:
+            if actual is None or value is None:
+                return False
+            if operator == "gt" and not actual > value:
+                return False
+            if operator == "lt" and not actual < value:
+                return False
+            if operator == "ge" and not actual >= value:
+                return False
+            if operator == "le" and not actual <= value:
+                return False
+    return True
+
+
+def parse_apply(text):
+    """
+        Parse $apply=groupby((A,B),aggregate(...)) into (group properties, aggregates)
+        Aggregates are (property or None for $count, method, alias)
+    """
+    match = re.match(r"^groupby\(\(([^)]*)\)(?:,\s*aggregate\((.*)\))?\)$", text.strip())
+    if not match:
+        raise ValueError(f"unsupported $apply: {text}")
+    group = [p.strip() for p in match.group(1).split(",") if p.strip()]
+    aggregates = []
+    for aggregate in split_top_level(match.group(2) or "", [","]):
+        count = re.match(r"^\$count\s+as\s+(\w+)$", aggregate.strip())
+        if count:
+            aggregates.append((None, "count", count.group(1)))
+            continue
+        method = re.match(r"^(\w+)\s+with\s+(sum|min|max|average)\s+as\s+(\w+)$", aggregate.strip())
+        if not method:
+            raise ValueError(f"unsupported aggregate: {aggregate}")
+        aggregates.append(method.groups())
+    return group, aggregates
+
+
+def apply_groupby(items, group, aggregates):
+    """
+        Return one result per distinct group value, in first-seen order
+    """
+    groups = {}
+    for item in items:
+        key = tuple(item.get(p) for p in group)
+        groups.setdefault(key, []).append(item)
+    results = []
+    for key, members in groups.items():
+        result = dict(zip(group, key))
+        for prop, method, alias in aggregates:
+            if method == "count":
+                result[alias] = len(members)
+                continue
+            values = [float(m[prop]) for m in members if m.get(prop) is not None]
+            if not values:
+                result[alias] = None
+            elif method == "sum":
+                result[alias] = sum(values)
+            elif method == "min":
+                result[alias] = min(values)
+            elif method == "max":
+                result[alias] = max(values)
+            else:
+                result[alias] = sum(values) / len(values)
+        results.append(result)
+    return results
+
+
+class MockIntersight:
+    """
+        Request handling state: the fleet, injected faults and filter results
+    """
+    def __init__(self, fleet, latency=0.0, throttle=0.0, retry_after=1, compress=True):
+        self.fleet = fleet
+        self.latency = latency
+        self.throttle = throttle
+        self.retry_after = retry_after
+        # gzip responses for clients sending Accept-Encoding: gzip
+        self.compress = compress
+        self.lock = threading.Lock()
+        # Matching indexes per (path, $filter), a filter is evaluated once over the collection
+        self.filtered = {}
+        # Aggregated results per (path, $filter, $apply)
+        self.applied = {}
+        self.requests = 0
+        self.throttled = 0
+
+    def get_indexes(self, table, filter_text):
+        """
+            Return the indexes of a collection matching $filter
+            Moid comparisons are answered from the Moid layout without scanning,
+            the other conditions are evaluated once per collection
+        """
+        conditions = parse_filter(filter_text) if filter_text else []
+        low, high = 0, table.count
+        others = []
+        for prop, operator, value in conditions:
+            if prop == "Moid" and operator in ["gt", "ge", "lt", "le"] and value is not None:
+                index = table.get_index(value)
+                if operator == "gt":
+                    low = max(low, index + 1)
+                elif operator == "ge":
+                    low = max(low, index)
+                elif operator == "lt":
+                    high = min(high, index)
+                else:
+                    high = min(high, index + 1)
+            else:
+                others.append((prop, operator, value))
+        if not others:
+            return range(low, max(low, high))
+        key = (table.path, tuple(others))
+        with self.lock:
+            indexes = self.filtered.get(key)
+        if indexes is None:
+            indexes = [i for i in range(table.count)
+                       if match_filter(self.fleet.get(table.path, i), others)]
+            with self.lock:
+                self.filtered[key] = indexes
+        return indexes[bisect_left(indexes, low):bisect_left(indexes, high)]
+
+    def get_applied(self, table, filter_text, apply_text, indexes):
+        """
+            Return the $apply results of a collection, computed once per query
+        """
+        key = (table.path, filter_text, apply_text)
+        with self.lock:
+            results = self.applied.get(key)
+        if results is None:
+            group, aggregates = parse_apply(apply_text)
+            results = apply_groupby((self.fleet.get(table.path, i) for i in indexes), group, aggregates)
+            with self.lock:
+                self.applied[key] = results
+        return results
+
+    def handle(self, path, query):
+        """
+            Return (status, headers, body) for a GET on an /api/v1 collection
+        """
+        with self.lock:
+            self.requests += 1
+            throttled = random.random() < self.throttle
+            if throttled:
+                self.throttled += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            return 429, {"Retry-After": str(self.retry_after)}, {"code": "TooManyRequests"}
+        table = self.fleet.tables.get(path[len("/api/v1/"):])
+        if table is None:
+            return 404, {}, {"code": "NotFound", "message": path}
+
+        params = {k: v[0] for k, v in parse_qs(query, keep_blank_values=True).items()}
+        try:
+            indexes = self.get_indexes(table, params.get("$filter"))
+        except ValueError as e:
+            return 400, {}, {"code": "InvalidRequest", "message": str(e)}
+        if params.get("$count", "").lower() == "true":
+            return 200, {}, {"ObjectType": "mo.DocumentCount", "Count": len(indexes)}
+        # Collections are kept in Moid order, $orderby only supports Moid
+        if params.get("$orderby", "").split() == ["Moid", "desc"]:
+            indexes = indexes[::-1]
+        skip = int(params.get("$skip", 0))
+        top = min(MAX_TOP, int(params.get("$top", DEFAULT_TOP)))
+        if "$apply" in params:
+            # Aggregated rows are paged like the objects of a collection
+            try:
+                results = self.get_applied(table, params.get("$filter"), params["$apply"], indexes)
+            except ValueError as e:
+                return 400, {}, {"code": "InvalidRequest", "message": str(e)}
+            return 200, {}, {"ObjectType": "mo.AggregateTransform", "Results": results[skip:skip + top]}
+
+        options = "&".join(f"{k}={params[k]}" for k in ["$select", "$expand"] if k in params)
+        select, expands = parse_options(options)
+        results = [project(self.fleet, self.fleet.get(table.path, i), select, expands)
+                   for i in indexes[skip:skip + top]]
+        body = {"ObjectType": "mo.List", "Results": results}
+        if params.get("$inlinecount") == "allpages":
+            body["Count"] = len(indexes)
+        return 200, {}, body
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, headers, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if self.mock.compress and "gzip" in self.headers.get("Accept-Encoding", ""):
+            # Fastest level, the mock should not be the bottleneck of a benchmark
+            data = gzip.compress(data, compresslevel=1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlsplit(self.path).path != "/iam/token":
+            self.send_json(404, {}, {"code": "NotFound"})
+            return
+        self.send_json(200, {}, {"access_token": "mock-token", "token_type": "Bearer", "expires_in": 3600})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        status, headers, body = self.mock.handle(url.path, url.query)
+        self.send_json(status, headers, body)
+
+
+def start_server(mock, host="127.0.0.1", port=8765):
+    """
+        Serve the mock in a background thread, return the server
+    """
+    handler = type("MockHandler", (Handler,), {"mock": mock})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mock Intersight API with a synthetic fleet")
+    parser.add_argument("--servers", type=int, default=1000, help="servers in the fleet (default: 1000)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API response")
+    parser.add_argument("--throttle", type=float, default=0.0, help="fraction of API requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of injected 429s, in seconds")
+    parser.add_argument("--no-gzip", action="store_true", help="never compress responses")
+    for name, value in FANOUT.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=value, help=f"per server (default: {value})")
+    args = parser.parse_args()
+
+    fleet = Fleet(args.servers, {name: getattr(args, name) for name in FANOUT},
+                  base_url=f"http://{args.host}:{args.port}")
+    mock = MockIntersight(fleet, latency=args.latency, throttle=args.throttle, retry_after=args.retry_after,
+                          compress=not args.no_gzip)
+    server = start_server(mock, args.host, args.port)
+    print(f"Mock Intersight on http://{args.host}:{args.port}: {fleet.blades} blades, {fleet.racks} racks, "
+          f"{fleet.chassis} chassis, {fleet.fis} FIs", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+    Projection planner for intersight_urls.json
+    Works out the minimal $select/$expand of each endpoint, and of the
+    NESTED_QUERIES a transform fetches, from the properties it reads, warns about entries without a projection and
+    reports the bytes saved per endpoint
+
+    Usage: ./projection.py
+"""
+import os
+import sys
+import json
+from dotenv import load_dotenv, find_dotenv
+from common import get_api_data, TokenManager, set_token_manager, set_base_url, BASE_URL
+
+# Properties read by each sheet transform, nested dicts are expanded relationships
+# Moid, ClassId and ObjectType are always returned by Intersight
+CONSUMERS = {
+    "Empty_Chassis_Slots": {"Name": None},
+    "Licenses": {"Name": None, "Model": None, "Serial": None, "Tags": None},
+    "ServerProfile_policies": {
+        "Name": None,
+        "TargetPlatform": None,
+        "AssociatedServer": {"Name": None, "Model": None, "Serial": None},
+        "PolicyBucket": {"Name": None},
+    },
+    "Vnics": {
+        "VethId": None, "Description": None, "BoundInterfaceDn": None,
+        "OperState": None, "OperReason": None, "PinnedInterfaceDn": None,
+        "NetworkElement": {
+            "SwitchProfileName": None, "Serial": None, "SwitchId": None, "Model": None,
+            "ManagementMode": None, "Operability": None, "AdminEvacState": None, "OperEvacState": None,
+        },
+    },
+    "Vhbas": {
+        "VfcId": None, "Description": None, "BoundInterfaceDn": None,
+        "OperState": None, "OperReason": None, "PinnedInterfaceDn": None,
+        "NetworkElement": {
+            "SwitchProfileName": None, "Serial": None, "SwitchId": None, "Model": None,
+            "ManagementMode": None, "Operability": None, "AdminEvacState": None, "OperEvacState": None,
+        },
+    },
+}
+
+# Queries of the API paths fetched by a sheet transform, in intersight_urls.json form
+NESTED_QUERIES = {
+    "Vnics": {
+        "path": "vnic/EthIfs",
+        "query_parameters": "$filter=LcpVnic ne 'null'&$expand=Profile($select=Name,AssociatedServer%3B$expand=AssociatedServer($select=Name,Model,Serial)),EthQosPolicy($select=Mtu,Cos,Priority),FabricEthNetworkGroupPolicy($select=VlanSettings),LcpVnic($select=LanConnectivityPolicy%3B$expand=LanConnectivityPolicy($select=Name))&$select=Name,MacAddress,FailoverEnabled,VifId,StandbyVifId,Placement,Profile,EthQosPolicy,FabricEthNetworkGroupPolicy,LcpVnic",
+    },
+    "Vhbas": {
+        "path": "vnic/FcIfs",
+        "query_parameters": "$filter=ScpVhba ne 'null'&$expand=FcAdapterPolicy($select=IoThrottleCount,LunCount,LunQueueDepth),FcNetworkPolicy($select=Name,VsanSettings),WwpnPool($select=Name),FcQosPolicy($select=Burst,Cos,Name,Priority,RateLimit),Profile($select=Name,AssociatedServer%3B$expand=AssociatedServer($select=Name,Model,Serial)),ScpVhba($select=SanConnectivityPolicy%3B$expand=SanConnectivityPolicy($select=Name))&$select=Name,Order,Placement,FcAdapterPolicy,FcNetworkPolicy,FcQosPolicy,Profile,ScpVhba,Type,VifId,Wwpn,WwpnAddressType,WwpnPool",
+    },
+}
+
+# Properties read from the NESTED_QUERIES objects by get_vnic_ethifs and get_vhba_fcifs
+NESTED_CONSUMERS = {
+    "Vnics": {
+        "Name": None, "MacAddress": None, "FailoverEnabled": None, "VifId": None,
+        "StandbyVifId": None, "Placement": None,
+        "Profile": {"Name": None, "AssociatedServer": {"Name": None, "Model": None, "Serial": None}},
+        "EthQosPolicy": {"Mtu": None, "Cos": None, "Priority": None},
+        "FabricEthNetworkGroupPolicy": {"VlanSettings": None},
+        "LcpVnic": {"LanConnectivityPolicy": {"Name": None}},
+    },
+    "Vhbas": {
+        "Name": None, "Placement": None, "VifId": None,
+        "FcAdapterPolicy": {"IoThrottleCount": None, "LunCount": None, "LunQueueDepth": None},
+        "FcNetworkPolicy": {"Name": None, "VsanSettings": None},
+        "WwpnPool": {"Name": None},
+        "FcQosPolicy": {"Burst": None, "Cos": None, "Name": None, "Priority": None, "RateLimit": None},
+        "Profile": {"Name": None, "AssociatedServer": {"Name": None, "Model": None, "Serial": None}},
+        "ScpVhba": {"SanConnectivityPolicy": {"Name": None}},
+    },
+}
+
+# Objects sampled per endpoint to estimate the payload size
+SAMPLE_SIZE = 100
+
+
+def split_top_level(text, separators):
+    """
+        Split text on any of the separators, ignoring those inside parentheses
+    """
+    parts = []
+    depth = 0
+    current = ""
+    i = 0
+    while i < len(text):
+        matched = None
+        if depth == 0:
+            for separator in separators:
+                if text.startswith(separator, i):
+                    matched = separator
+                    break
+        if matched:
+            parts.append(current)
+            current = ""
+            i += len(matched)
+            continue
+        if text[i] == "(":
+            depth += 1
+        elif text[i] == ")":
+            depth -= 1
+        current += text[i]
+        i += 1
+    if current:
+        parts.append(current)
+    return parts
+
+
+def parse_options(options):
+    """
+        Parse $select/$expand options into a projection tree
+        Returns None when there is no $select (every property is returned)
+    """
+    tree = None
+    expands = {}
+    for option in split_top_level(options, ["&", "%3B", ";"]):
+        if option.startswith("$select="):
+            tree = {p: None for p in option[len("$select="):].split(",") if p}
+        elif option.startswith("$expand="):
+            for item in split_top_level(option[len("$expand="):], [","]):
+                name, _, sub_options = item.partition("(")
+                sub_tree = parse_options(sub_options[:-1]) if sub_options else None
+                expands[name] = sub_tree if sub_tree is not None else {}
+    if tree is None and not expands:
+        return None
+    tree = tree if tree is not None else {}
+    tree.update(expands)
+    return tree
+
+
+def build_options(tree, separator="&"):
+    """
+        Build $select/$expand options from a projection tree
+    """
+    options = [f"$select={','.join(tree)}"]
+    expands = []
+    for name, sub_tree in tree.items():
+        if sub_tree is None:
+            continue
+        if sub_tree:
+            expands.append(f"{name}({build_options(sub_tree, '%3B')})")
+        else:
+            expands.append(name)
+    if expands:
+        options.insert(0, f"$expand={','.join(expands)}")
+    return separator.join(options)
+
+
+def tree_properties(tree, prefix=""):
+    """
+        Return the set of property paths of a projection tree
+    """
+    properties = set()
+    for name, sub_tree in tree.items():
+        properties.add(f"{prefix}{name}")
+        if sub_tree:
+            properties |= tree_properties(sub_tree, f"{prefix}{name}.")
+    return properties
+
+
+def plan_query(query_parameters, consumer):
+    """
+        Return query parameters with the minimal projection for the consumer
+        Parameters other than $select/$expand, such as $filter, are kept
+    """
+    params = [p for p in split_top_level(query_parameters, ["&"])
+              if not p.startswith("$select=") and not p.startswith("$expand=")]
+    params.append(build_options(consumer))
+    return "&".join(params)
+
+
+def plan_projections(endpoints, consumers=CONSUMERS):
+    """
+        Apply the minimal projection to every endpoint with a registered consumer
+        consumers is CONSUMERS for intersight_urls.json, NESTED_CONSUMERS for NESTED_QUERIES
+        Prints a warning for entries that have no projection at all, and for
+        properties a transform reads that the configured query did not select
+        Returns the endpoints with planned query parameters
+    """
+    planned = {}
+    for sheet_name, endpoint in endpoints.items():
+        endpoint = dict(endpoint)
+        tree = parse_options(endpoint['query_parameters'])
+        if tree is None:
+            print(f"-> Warning: {sheet_name} has no $select, every property of {endpoint['path']} is downloaded",
+                  file=sys.stderr)
+        consumer = consumers.get(sheet_name)
+        if consumer is not None:
+            if tree is not None:
+                missing = tree_properties(consumer) - tree_properties(tree)
+                if missing:
+                    print(f"-> Warning: {sheet_name} query does not select {', '.join(sorted(missing))}",
+                          file=sys.stderr)
+            # Queries that already match keep their exact URL (cache and snapshot keys)
+            if tree is None or tree_properties(consumer) != tree_properties(tree):
+                endpoint['query_parameters'] = plan_query(endpoint['query_parameters'], consumer)
+        planned[sheet_name] = endpoint
+    return planned
+
+
+def check_derived(json_data):
+    """
+        Warn when a derived entry's "select" misses properties its transform reads
+    """
+    for sheet_name, endpoint in json_data.items():
+        if "derived_from" not in endpoint or sheet_name not in CONSUMERS:
+            continue
+        selected = set(endpoint.get("select", "").split(","))
+        missing = tree_properties(CONSUMERS[sheet_name]) - selected
+        if missing:
+            print(f"-> Warning: {sheet_name} select does not include {', '.join(sorted(missing))}",
+                  file=sys.stderr)
+
+
+def measure_bytes(client_id, client_secret, token, api_url):
+    """
+        Return the object count and average JSON bytes per object of an API URL
+        Estimated from the first SAMPLE_SIZE objects
+    """
+    separator = "&" if "?" in api_url else "?"
+    response = get_api_data(client_id, client_secret, token,
+                            f"{api_url}{separator}$top={SAMPLE_SIZE}&$inlinecount=allpages")
+    results = response["Results"]
+    if not results:
+        return response["Count"], 0
+    return response["Count"], len(json.dumps(results)) / len(results)
+
+
+if __name__ == '__main__':
+    from generate_report import get_api_url, resolve_derived
+
+    load_dotenv(find_dotenv())
+    client_id = os.getenv("ClientId")
+    client_secret = os.getenv("ClientSecret")
+    base_url = os.getenv("BaseUrl", BASE_URL).rstrip("/")
+    set_base_url(base_url)
+    base_path = f"{base_url}/api/v1/"
+
+    token_manager = TokenManager(client_id, client_secret, token_file=os.getenv("TokenFile"))
+    set_token_manager(token_manager)
+    token = token_manager.get_token()
+
+    with open('intersight_urls.json', 'r') as f:
+        json_data = json.load(f)
+    # Summary entries ("apply") are aggregated by Intersight, their detail collections are never downloaded
+    details = {k: v for k,v in json_data.items() if "apply" not in v}
+    check_derived(details)
+    endpoints, derived, strip = resolve_derived(details)
+    planned = plan_projections(endpoints)
+    # Queries of the transforms, reported as <sheet>/<path>
+    for sheet_name, endpoint in NESTED_QUERIES.items():
+        endpoints[f"{sheet_name}/{endpoint['path']}"] = endpoint
+    for sheet_name, endpoint in plan_projections(NESTED_QUERIES, NESTED_CONSUMERS).items():
+        planned[f"{sheet_name}/{endpoint['path']}"] = endpoint
+
+    print(f"{'Sheet':<25}{'Objects':>10}{'Configured':>14}{'Planned':>14}{'Saved':>14}")
+    for sheet_name, endpoint in endpoints.items():
+        count, configured = measure_bytes(client_id, client_secret, token, get_api_url(base_path, endpoint))
+        planned_size = configured
+        if planned[sheet_name] != endpoint:
+            _, planned_size = measure_bytes(client_id, client_secret, token,
+                                            get_api_url(base_path, planned[sheet_name]))
+        saved = (configured - planned_size) * count
+        print(f"{sheet_name:<25}{count:>10}{configured * count:>14.0f}{planned_size * count:>14.0f}{saved:>14.0f}")
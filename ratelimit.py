@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+    Rate governor shared by every Intersight API call
+    Token bucket whose rate adapts to 429 responses and rate-limit headers,
+    plus a global cap on requests in flight
+"""
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+# Multiplicative decrease on 429, additive increase on success
+RATE_DECREASE = 0.5
+RATE_INCREASE = 0.5
+# Backoff when a 429/5xx or a connection error comes without Retry-After: BACKOFF_BASE * 2^attempt, capped
+BACKOFF_BASE = 1.0
+MAX_BACKOFF = 60.0
+# Up to this fraction of the wait is added as random jitter
+JITTER = 0.25
+
+
+def parse_seconds(value):
+    """
+        Return a header value in seconds, or None if missing or not numeric
+    """
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateGovernor:
+    """
+        Token bucket rate limiter with adaptive rate and a concurrency cap
+        Every request takes one token and one in-flight slot
+        A 429 halves the rate and pauses all callers until Retry-After
+        (plus jitter) has elapsed. Successes slowly raise the rate back
+        towards max_rate
+    """
+    def __init__(self, rate=10.0, max_rate=50.0, min_rate=1.0, burst=10, max_in_flight=16):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def set_max_in_flight(self, max_in_flight):
+        """
+            Update the cap on requests in flight, before any request is made
+        """
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def acquire(self):
+        """
+            Block until a token is available and no throttle pause is active
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    @contextmanager
+    def request(self):
+        """
+            Context manager held around a single HTTP request
+        """
+        self.acquire()
+        with self.in_flight:
+            yield
+
+    def throttled(self, retry_after, attempt):
+        """
+            Record a 429 (or retryable 5xx, dropped connection or timeout) and return the wait in seconds before retrying
+            All callers are paused for that long
+        """
+        wait = parse_seconds(retry_after)
+        if wait is None:
+            wait = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt)
+        wait += random.uniform(0, wait * JITTER)
+        with self.lock:
+            now = time.monotonic()
+            # Concurrent 429s within one pause count as a single throttle event
+            if now >= self.paused_until:
+                self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+            self.tokens = 0
+            self.paused_until = max(self.paused_until, now + wait)
+        return wait
+
+    def update(self, headers):
+        """
+            Record a successful response and adapt the rate to its rate-limit headers
+        """
+        remaining = parse_seconds(headers.get("X-RateLimit-Remaining"))
+        reset = parse_seconds(headers.get("X-RateLimit-Reset"))
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+            if remaining is not None and reset is not None:
+                # Spread the remaining budget over the rest of the window
+                self.rate = max(self.min_rate, min(self.rate, remaining / max(reset, 1.0)))
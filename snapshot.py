@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+    Local SQLite snapshot of Intersight endpoint objects, keyed by Moid
+    After the first full pull, each sync only requests objects whose ModTime is
+    newer than the endpoint's last successful sync, and uses a Moid-only listing
+    to drop objects deleted in Intersight
+    Endpoints with $expand are pulled in full on every sync, a change to an
+    expanded object does not bump the ModTime of the object it is expanded into
+"""
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from common import get_data, get_cursor_data, add_filter, get_moid_url
+
+# ModTime window re-requested on every delta sync, to absorb clock skew
+SYNC_OVERLAP = timedelta(minutes=5)
+
+
+class SnapshotStore:
+    """
+        Snapshot store for endpoint objects
+        Tables:
+            objects: endpoint, moid, data (raw API object as JSON)
+            syncs: endpoint, api_url, last_sync (ISO 8601 UTC)
+    """
+    def __init__(self, db_file="./Data/snapshot.db"):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS objects "
+                                    "(endpoint TEXT, moid TEXT, data TEXT, PRIMARY KEY (endpoint, moid))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS syncs "
+                                    "(endpoint TEXT PRIMARY KEY, api_url TEXT, last_sync TEXT)")
+
+    def get_last_sync(self, endpoint, api_url):
+        """
+            Return the last sync time of the endpoint, or None if it needs a full pull
+            A changed api_url ($select/$expand/$filter) also triggers a full pull
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT api_url, last_sync FROM syncs WHERE endpoint = ?",
+                                          (endpoint,)).fetchone()
+        if row is None or row[0] != api_url:
+            return None
+        return datetime.fromisoformat(row[1])
+
+    def sync_endpoint(self, client_id, client_secret, token, endpoint, api_url, cursor_ranges=0):
+        """
+            Bring the endpoint snapshot up to date and return all of its objects
+            With cursor_ranges, collections are paged on Moid over that many ranges
+            An api_url with $expand always gets a full pull
+        """
+        def get_all(url):
+            if cursor_ranges:
+                return get_cursor_data(client_id, client_secret, token, url, cursor_ranges)
+            return get_data(client_id, client_secret, token, None, url)
+
+        sync_start = datetime.now(timezone.utc)
+        last_sync = self.get_last_sync(endpoint, api_url)
+        # ModTime gt would miss the objects whose only change is in an expanded object
+        if "$expand" in api_url:
+            last_sync = None
+
+        if last_sync is None:
+            print(f"-> {endpoint}: full sync")
+            data = get_all(api_url)
+            with self.lock, self.connection:
+                self.connection.execute("DELETE FROM objects WHERE endpoint = ?", (endpoint,))
+                self.merge(endpoint, data)
+        else:
+            mod_time = (last_sync - SYNC_OVERLAP).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            delta_url = add_filter(api_url, f"ModTime gt {mod_time}")
+            data = get_all(delta_url)
+            moids = get_all(get_moid_url(api_url))
+            live_moids = set(item["Moid"] for item in moids)
+            with self.lock, self.connection:
+                self.merge(endpoint, data)
+                stored_moids = self.connection.execute("SELECT moid FROM objects WHERE endpoint = ?",
+                                                       (endpoint,)).fetchall()
+                deleted = [(endpoint, moid) for (moid,) in stored_moids if moid not in live_moids]
+                self.connection.executemany("DELETE FROM objects WHERE endpoint = ? AND moid = ?", deleted)
+            print(f"-> {endpoint}: {len(data)} changed, {len(deleted)} deleted")
+
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO syncs (endpoint, api_url, last_sync) VALUES (?, ?, ?)",
+                                    (endpoint, api_url, sync_start.isoformat()))
+        return self.get_objects(endpoint)
+
+    def merge(self, endpoint, data):
+        """
+            Insert or replace objects by Moid
+            Called with self.lock held, inside a transaction
+        """
+        rows = [(endpoint, item["Moid"], json.dumps(item)) for item in data]
+        self.connection.executemany("INSERT OR REPLACE INTO objects (endpoint, moid, data) VALUES (?, ?, ?)", rows)
+
+    def get_objects(self, endpoint):
+        """
+            Return all stored objects of the endpoint, ordered by Moid
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT data FROM objects WHERE endpoint = ? ORDER BY moid",
+                                           (endpoint,)).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
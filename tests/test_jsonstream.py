@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+    Tests for the incremental Results decoder, run with: python -m unittest discover tests
+    Bodies are split at every position to cover values cut across chunks
+"""
+import json
+import unittest
+from unittest import mock
+
+import jsonstream
+from jsonstream import ResultsDecoder, iter_results
+
+RESULTS = [
+    {"Moid": "5f1a", "Name": "blade-1", "Count": 12, "Ratio": 1.25, "Big": -3e5, "Small": 1E-2, "Zero": 0},
+    {"Description": "quote \" backslash \\ slash / tab \t", "Braces": "} ] { [ , :", "Escaped": "é日"},
+    {"Nested": {"List": [[1, 2], [], [{"A": [3.5, {"B": None}]}]], "Empty": {}}, "Flags": [True, False, None]},
+    {"Unicode": "café 日本 \U0001f600", "Negative": -17, "Exponent": 6.02e+23},
+]
+
+
+def make_body(results, **fields):
+    """
+        Return a list response as UTF-8 bytes, with fields before and after Results
+    """
+    body = {"ObjectType": "mo.List", "Count": len(results), "Results": results}
+    body.update(fields)
+    return json.dumps(body, ensure_ascii=False).encode()
+
+
+def split_chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class ResultsDecoderTest(unittest.TestCase):
+    def setUp(self):
+        # Exercise the incremental decoder even where orjson is installed
+        patcher = mock.patch.object(jsonstream, "orjson", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def decode(self, chunks):
+        fields = {}
+        return list(iter_results(chunks, fields)), fields
+
+    def test_every_chunk_size(self):
+        body = make_body(RESULTS, Trailer="end")
+        for size in range(1, 64):
+            results, fields = self.decode(split_chunks(body, size))
+            self.assertEqual(results, RESULTS, f"chunk size {size}")
+            self.assertEqual(fields, {"ObjectType": "mo.List", "Count": len(RESULTS), "Trailer": "end"})
+
+    def test_every_split_position(self):
+        text = make_body(RESULTS).decode()
+        for split in range(len(text) + 1):
+            decoder = ResultsDecoder()
+            objects = decoder.feed(text[:split])
+            objects += decoder.feed(text[split:])
+            objects += decoder.close()
+            self.assertEqual(objects, RESULTS, f"split at {split}: {text[max(0, split - 10):split + 10]!r}")
+
+    def test_escapes_split(self):
+        # \u escapes, surrogate pairs and an escaped slash cut at every position
+        text = '{"Results": [{"Name": "caf\\u00e9 \\ud83d\\ude00 a\\/b \\"q\\" \\\\"}], "Count": 1}'
+        for split in range(len(text) + 1):
+            decoder = ResultsDecoder()
+            objects = decoder.feed(text[:split]) + decoder.feed(text[split:]) + decoder.close()
+            self.assertEqual(objects, [{"Name": "caf\u00e9 \U0001f600 a/b \"q\" \\"}], f"split at {split}")
+
+    def test_numbers_split_at_dot_and_exponent(self):
+        body = b'{"Results": [1.25, 2e10, -0.5E-3, 7], "Count": 4}'
+        for split in range(len(body) + 1):
+            results, fields = self.decode([body[:split], body[split:]])
+            self.assertEqual(results, [1.25, 2e10, -0.5E-3, 7], f"split at {split}")
+            self.assertEqual(fields, {"Count": 4})
+
+    def test_multibyte_character_split(self):
+        body = make_body([{"Name": "日本\U0001f600"}])
+        for size in range(1, 8):
+            results, _ = self.decode(split_chunks(body, size))
+            self.assertEqual(results, [{"Name": "日本\U0001f600"}])
+
+    def test_objects_returned_as_completed(self):
+        decoder = ResultsDecoder()
+        text = make_body(RESULTS[:2]).decode()
+        first_end = text.index("}, {") + 1
+        self.assertEqual(decoder.feed(text[:first_end + 1]), RESULTS[:1])
+        self.assertEqual(decoder.feed(text[first_end + 1:]) + decoder.close(), RESULTS[1:2])
+
+    def test_empty_results(self):
+        results, fields = self.decode([b'{"ObjectType": "mo.List", "Results": []}'])
+        self.assertEqual(results, [])
+        self.assertEqual(fields, {"ObjectType": "mo.List"})
+
+    def test_incomplete_body(self):
+        body = make_body(RESULTS)
+        with self.assertRaises(ValueError):
+            self.decode([body[:-5]])
+
+    def test_not_an_object(self):
+        with self.assertRaises(ValueError):
+            self.decode([b'[{"Moid": "1"}]'])
+
+    def test_results_not_a_list(self):
+        with self.assertRaises(ValueError):
+            self.decode([b'{"Results": {"Moid": "1"}}'])
+
+
+if __name__ == '__main__':
+    unittest.main()
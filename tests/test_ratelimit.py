@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+    Tests for the rate governor, run with: python -m unittest discover tests
+    Token refill and pauses run on a fake clock, the in-flight cap on real threads
+"""
+import time
+import threading
+import unittest
+from unittest import mock
+
+import ratelimit
+from ratelimit import RateGovernor
+
+
+class FakeClock:
+    """
+        Stands in for the time module of ratelimit, sleep() advances monotonic()
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        # A real sleep always lets some time pass, also for a float rounding remainder
+        self.now += max(seconds, 1e-9)
+
+    def waits(self):
+        """
+            Return the sleeps longer than a float rounding remainder
+        """
+        return [seconds for seconds in self.sleeps if seconds > 1e-6]
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patchers = [mock.patch.object(ratelimit, "time", self.clock),
+                    # No jitter, waits are exact
+                    mock.patch.object(ratelimit.random, "uniform", return_value=0.0)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_burst_without_waiting(self):
+        governor = RateGovernor(rate=10.0, burst=5)
+        for _ in range(5):
+            governor.acquire()
+        self.assertEqual(self.clock.waits(), [])
+
+    def test_blocks_until_a_token_refills(self):
+        governor = RateGovernor(rate=10.0, burst=2)
+        governor.acquire()
+        governor.acquire()
+        governor.acquire()
+        self.assertEqual(len(self.clock.waits()), 1)
+        self.assertAlmostEqual(self.clock.waits()[0], 0.1)
+
+    def test_refill_rate_and_cap(self):
+        governor = RateGovernor(rate=10.0, burst=5)
+        for _ in range(5):
+            governor.acquire()
+        # Half a second at 10/s refills 5 tokens, 30 seconds still only a burst
+        self.clock.now += 0.5
+        for _ in range(5):
+            governor.acquire()
+        self.assertEqual(self.clock.waits(), [])
+        self.clock.now += 30
+        for _ in range(6):
+            governor.acquire()
+        self.assertEqual(len(self.clock.waits()), 1)
+        self.assertAlmostEqual(self.clock.waits()[0], 0.1)
+
+    def test_sustained_rate(self):
+        governor = RateGovernor(rate=20.0, burst=1)
+        start = self.clock.now
+        for _ in range(101):
+            governor.acquire()
+        self.assertAlmostEqual(self.clock.now - start, 5.0, places=5)
+
+    def test_retry_after_pauses_every_caller(self):
+        governor = RateGovernor(rate=10.0, burst=5)
+        wait = governor.throttled("2", attempt=0)
+        self.assertEqual(wait, 2.0)
+        self.assertEqual(governor.rate, 5.0)
+        start = self.clock.now
+        governor.acquire()
+        # Paused for Retry-After, the bucket was emptied so it also waits for a token
+        self.assertGreaterEqual(self.clock.now - start, 2.0)
+
+    def test_backoff_without_retry_after(self):
+        governor = RateGovernor()
+        self.assertEqual(governor.throttled(None, attempt=0), ratelimit.BACKOFF_BASE)
+        self.assertEqual(governor.throttled(None, attempt=3), ratelimit.BACKOFF_BASE * 8)
+        self.assertEqual(governor.throttled("not a number", attempt=20), ratelimit.MAX_BACKOFF)
+
+    def test_concurrent_throttles_decrease_once(self):
+        governor = RateGovernor(rate=16.0, min_rate=1.0)
+        governor.throttled("5", attempt=0)
+        governor.throttled("5", attempt=0)
+        self.assertEqual(governor.rate, 8.0)
+        self.clock.now += 6
+        governor.throttled("5", attempt=0)
+        self.assertEqual(governor.rate, 4.0)
+
+    def test_rate_floor(self):
+        governor = RateGovernor(rate=1.5, min_rate=1.0)
+        governor.throttled("1", attempt=0)
+        self.assertEqual(governor.rate, 1.0)
+
+    def test_success_raises_rate_up_to_max(self):
+        governor = RateGovernor(rate=49.8, max_rate=50.0)
+        governor.update({})
+        self.assertEqual(governor.rate, 50.0)
+        governor.update({})
+        self.assertEqual(governor.rate, 50.0)
+
+    def test_rate_limit_headers_spread_the_budget(self):
+        governor = RateGovernor(rate=20.0, max_rate=50.0)
+        governor.update({"X-RateLimit-Remaining": "30", "X-RateLimit-Reset": "10"})
+        self.assertEqual(governor.rate, 3.0)
+        governor.update({"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "10"})
+        self.assertEqual(governor.rate, governor.min_rate)
+
+
+class InFlightTest(unittest.TestCase):
+    def test_in_flight_cap(self):
+        governor = RateGovernor(rate=1000.0, burst=100, max_in_flight=2)
+        release = threading.Event()
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def request():
+            with governor.request():
+                with lock:
+                    active.append(1)
+                    peak.append(len(active))
+                release.wait(5)
+                with lock:
+                    active.pop()
+
+        threads = [threading.Thread(target=request) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        # Two requests hold the slots, the other three wait for one
+        self.assertEqual(len(active), 2)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(peak), 5)
+        self.assertLessEqual(max(peak), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+    Moid index over the fetched parent datasets (chassis, servers, boards,
+    memory arrays, storage controllers, fan modules)
+    Component rows only carry Parent_Moid. Walking up the parent chain in the
+    index gives the server, chassis and domain that own them, without any
+    $expand=Parent(...) or extra request
+"""
+
+# Sheets indexed by Moid, in intersight_urls.json naming, with their API path
+TOPOLOGY_SOURCES = {
+    "Chassis": "equipment/Chasses",
+    "Blades": "compute/Blades",
+    "Racks": "compute/RackUnits",
+    "Motherboards": "compute/Boards",
+    "Fan_module": "equipment/FanModules",
+    "Memory_array": "memory/Arrays",
+    "Storage_controller": "storage/Controllers",
+}
+SOURCE_PATHS = {path: sheet_name for sheet_name, path in TOPOLOGY_SOURCES.items()}
+# Owners at the top of the chain, their own rows are not enriched
+SERVER_SHEETS = ["Blades", "Racks"]
+CHASSIS_SHEETS = ["Chassis"]
+# Columns added to the component rows
+TOPOLOGY_COLUMNS = ["Server", "Server_Serial", "Chassis", "Domain"]
+# Longest parent chain walked, e.g. DIMM -> memory array -> board -> blade -> chassis
+MAX_DEPTH = 8
+
+
+def add_parent_prefix(item, prefixes):
+    """
+        Add the collection URL of a row's parent, its Parent_link without the
+        Moid, to prefixes. None stands for a parent without Parent_link
+    """
+    if item.get("Parent_Moid") is None:
+        return
+    link = item.get("Parent_link")
+    prefixes.add(link.rpartition("/")[0] if link is not None else None)
+
+
+def get_parent_sheets(prefixes):
+    """
+        Return the TOPOLOGY_SOURCES of parent collection URLs, e.g.
+        .../api/v1/compute/Boards -> Motherboards
+        A parent without Parent_link may be in any of them
+    """
+    if None in prefixes:
+        return set(TOPOLOGY_SOURCES)
+    sheets = set()
+    for prefix in prefixes:
+        path = prefix.partition("/api/v1/")[2]
+        if path in SOURCE_PATHS:
+            sheets.add(SOURCE_PATHS[path])
+    return sheets
+
+
+def get_parents(rows):
+    """
+        Return the TOPOLOGY_SOURCES the parents of the rows are in
+    """
+    prefixes = set()
+    for item in rows:
+        add_parent_prefix(item, prefixes)
+    return get_parent_sheets(prefixes)
+
+
+def get_domain(chassis):
+    """
+        Return the UCS domain of a chassis, named <domain>-<ChassisId> by Intersight
+    """
+    name = chassis.get("Name")
+    suffix = f"-{chassis.get('ChassisId')}"
+    if name and name.endswith(suffix):
+        return name[:-len(suffix)]
+    return None
+
+
+class TopologyIndex:
+    """
+        nodes maps a Moid to (parent Moid, sheet name, row properties) and
+        owners memoizes the walk from a Moid to its owners, so the components
+        sharing a board or a memory array are resolved in one lookup
+        parents maps each indexed sheet to the sources its rows point to
+    """
+    def __init__(self):
+        self.nodes = {}
+        self.owners = {}
+        self.parents = {}
+
+    def add(self, sheet_name, rows):
+        """
+            Index the rows of a source sheet by Moid, only the properties the walk reads are kept
+        """
+        prefixes = set()
+        for item in rows:
+            add_parent_prefix(item, prefixes)
+            moid = item.get("Moid")
+            if moid is None:
+                continue
+            if sheet_name in SERVER_SHEETS:
+                properties = (item.get("Name"), item.get("Serial"))
+            elif sheet_name in CHASSIS_SHEETS:
+                properties = (item.get("Name"), get_domain(item))
+            else:
+                properties = None
+            self.nodes[moid] = (item.get("Parent_Moid"), sheet_name, properties)
+        self.parents[sheet_name] = get_parent_sheets(prefixes)
+        self.owners.clear()
+
+    def get_owners(self, moid):
+        """
+            Return (server name, server serial, chassis name, domain) of the
+            object with this Moid, None for the owners not found
+        """
+        owners = self.owners.get(moid)
+        if owners is not None:
+            return owners
+        server = serial = chassis = domain = None
+        node = self.nodes.get(moid)
+        depth = 0
+        while node is not None and depth < MAX_DEPTH:
+            parent_moid, sheet_name, properties = node
+            if sheet_name in SERVER_SHEETS and server is None:
+                server, serial = properties
+            elif sheet_name in CHASSIS_SHEETS:
+                chassis, domain = properties
+                break
+            node = self.nodes.get(parent_moid)
+            depth += 1
+        owners = (server, serial, chassis, domain)
+        self.owners[moid] = owners
+        return owners
+
+    def enrich(self, rows):
+        """
+            Yield each row as a dict with the TOPOLOGY_COLUMNS of its parent added
+            Every row gets the columns, they are None when its parent is not indexed
+        """
+        for item in rows:
+            row = dict(item.items())
+            row.update(zip(TOPOLOGY_COLUMNS, self.get_owners(item.get("Parent_Moid"))))
+            yield row
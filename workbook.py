@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+    Excel helpers for the Intersight reports
+    Kept apart from common.py so that runs which never write a workbook
+    (--fetch-only, projection.py) do not import openpyxl
+    Libraries: pip install openpyxl
+"""
+import os
+from openpyxl import load_workbook
+from openpyxl.workbook import Workbook
+from openpyxl.styles import Font, PatternFill
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+
+
+# Shared styles, created once instead of once per cell
+HEADER_FONT = Font(name='Calibri', size=18)
+HEADER_FILL = PatternFill(start_color='66ccff', end_color='66ccff', fill_type='solid')
+CELL_FONT = Font(name='Calibri', size=14)
+LINK_FONT = Font(name="Calibri", underline="single", size=18, color="0066cc")
+
+
+def add_header_row(sheet, header_list):
+    """
+        Add Headers Row to the Sheet
+    """
+    for column, value in enumerate(header_list, start=1):
+        cell = sheet.cell(row=1, column=column, value=value)
+        cell.font = HEADER_FONT
+        cell.fill = HEADER_FILL
+
+
+def add_cell_data(sheet, header_list, data):
+    """
+        Add Data in Sheet Cells
+        Returns the max value length of each column, header included,
+        tracked while writing so no separate autofit pass is needed
+    """
+    column_index = {column_name: column for column, column_name in enumerate(header_list, start=1)}
+    widths = [len(str(column_name)) for column_name in header_list]
+    for row, item in enumerate(data, start=2):
+        for column_name, value in item.items():
+            column = column_index[column_name]
+            cell = sheet.cell(row=row, column=column, value=value)
+            cell.font = CELL_FONT
+            if value is not None:
+                length = len(str(value))
+                if length > widths[column - 1]:
+                    widths[column - 1] = length
+    return widths
+
+
+def set_column_widths(sheet, widths):
+    """
+        Set column widths from max value lengths, as size_columns does
+    """
+    for column, width in enumerate(widths, start=1):
+        sheet.column_dimensions[get_column_letter(column)].width = width + 10
+
+
+def size_columns(sheet):
+    """
+        Adjust the width of every column in the sheet to its longest value
+    """
+    for column in sheet.columns:
+        max_length = 0
+        column_letter = column[0].column_letter
+        for cell in column:
+            if cell.value is not None and len(str(cell.value)) > max_length:
+                max_length = len(str(cell.value))
+        adjusted_width = (max_length + 10)
+        sheet.column_dimensions[column_letter].width = adjusted_width
+
+
+def column_widths(header_list, data):
+    """
+        Return the max value length of each column, header included
+    """
+    widths = [len(str(column_name)) for column_name in header_list]
+    header_index = {column_name: index for index, column_name in enumerate(header_list)}
+    for item in data:
+        for column_name, value in item.items():
+            index = header_index[column_name]
+            if value is not None and len(str(value)) > widths[index]:
+                widths[index] = len(str(value))
+    return widths
+
+
+def add_hyperlinks(workbook, sheet):
+    """
+        Fill the sheet with hyperlinks pointing to all the other sheets in the workbook
+    """
+    # Set Header Row
+    cell = sheet.cell(row=1, column=1, value="Hyperlinks")
+    cell.font = HEADER_FONT
+    cell.fill = HEADER_FILL
+
+    # Add Hyperlinks
+    sheets = workbook.sheetnames
+    if sheet.title in sheets:
+        sheets.remove(sheet.title)
+
+    for i,sheet_name in enumerate(sheets, start=2):
+        cell_value = sheet_name.upper()
+        link_value = f"#{sheet_name}!A{i}"
+        cell = sheet.cell(row=i, column=1, value=cell_value)
+        cell.hyperlink = link_value
+        cell.font = LINK_FONT
+
+    size_columns(sheet)
+
+
+def move_sheet_first(workbook, sheet_name):
+    """
+        Move the sheet to Index 0 and make it the Active sheet
+    """
+    # Get the sheet's current position (index)
+    sheet_index = workbook.sheetnames.index(sheet_name)
+    new_position = - sheet_index
+    
+    # Move sheet to Index 0
+    workbook.move_sheet(sheet_name, new_position)
+
+    # Set Active sheet
+    workbook.active = workbook[sheet_name]
+
+
+class WorkbookSession:
+    """
+        Build all the sheets of a workbook in memory and write the file once
+        With write_only=True, rows are streamed to disk as they are appended
+        and each sheet's headers and column widths must be known up front
+        With update=True an existing file is loaded, the sheets written to it
+        replace the ones of the same name and the other sheets are kept.
+        A loaded workbook cannot be write-only, write_only is then ignored.
+        openpyxl parses and writes back every sheet of the file, so an update
+        costs about as much as rendering the whole workbook
+    """
+    def __init__(self, file_name, write_only=False, update=False):
+        self.file_name = file_name
+        if update and os.path.isfile(file_name):
+            print(f"-> Updating {file_name}: all of its sheets are loaded and saved again")
+            self.write_only = False
+            self.workbook = load_workbook(filename=file_name)
+            return
+        self.write_only = write_only
+        self.workbook = Workbook(write_only=write_only)
+        if not write_only:
+            # Drop the default empty "Sheet"
+            self.workbook.remove(self.workbook.active)
+
+    def create_sheet(self, sheet_name):
+        """
+            Return a new empty sheet, an existing sheet of the same name is
+            replaced at its position
+        """
+        if sheet_name not in self.workbook.sheetnames:
+            return self.workbook.create_sheet(sheet_name)
+        index = self.workbook.sheetnames.index(sheet_name)
+        self.workbook.remove(self.workbook[sheet_name])
+        return self.workbook.create_sheet(sheet_name, index)
+
+    def add_sheet(self, sheet_name, header_list, data):
+        """
+            Write headers and rows to a sheet and autofit its columns
+        """
+        if self.write_only:
+            widths = column_widths(header_list, data)
+            self.stream_sheet(sheet_name, header_list, data, widths)
+            return
+        sheet = self.create_sheet(sheet_name)
+        add_header_row(sheet, header_list)
+        widths = add_cell_data(sheet, header_list, data)
+        set_column_widths(sheet, widths)
+
+    def stream_sheet(self, sheet_name, header_list, rows, widths):
+        """
+            Append rows one at a time to a new write-only sheet, or to a regular
+            sheet of a loaded workbook. rows can be any iterable of dicts, e.g. iter_spooled
+        """
+        sheet = self.create_sheet(sheet_name)
+        set_column_widths(sheet, widths)
+
+        header_row = []
+        for value in header_list:
+            cell = WriteOnlyCell(sheet, value=value)
+            cell.font = HEADER_FONT
+            cell.fill = HEADER_FILL
+            header_row.append(cell)
+        sheet.append(header_row)
+
+        for item in rows:
+            row = []
+            for column_name in header_list:
+                cell = WriteOnlyCell(sheet, value=item.get(column_name))
+                cell.font = CELL_FONT
+                row.append(cell)
+            sheet.append(row)
+
+    def add_hyperlinks_sheet(self, sheet_name="Hyperlinks"):
+        """
+            Create a Hyperlinks sheet pointing to all the other sheets
+        """
+        if not self.write_only:
+            sheet = self.create_sheet(sheet_name)
+            add_hyperlinks(self.workbook, sheet)
+            return
+
+        sheets = self.workbook.sheetnames
+        sheet = self.workbook.create_sheet(sheet_name)
+        width = max([len(sheet_name)] + [len(name) for name in sheets])
+        sheet.column_dimensions["A"].width = width + 10
+
+        cell = WriteOnlyCell(sheet, value="Hyperlinks")
+        cell.font = HEADER_FONT
+        cell.fill = HEADER_FILL
+        sheet.append([cell])
+
+        for i,name in enumerate(sheets, start=2):
+            cell = WriteOnlyCell(sheet, value=name.upper())
+            cell.hyperlink = f"#{name}!A{i}"
+            cell.font = LINK_FONT
+            sheet.append([cell])
+
+    def set_default_sheet(self, sheet_name):
+        """
+            Move the sheet to the front and make it the Active sheet
+        """
+        move_sheet_first(self.workbook, sheet_name)
+
+    def save(self):
+        """
+            Write the workbook to disk
+        """
+        self.workbook.save(self.file_name)
+        self.workbook.close()